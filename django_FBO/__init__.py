@@ -1,4 +1,6 @@
 from .file_objects import FileObject
 from .manager import FBO
 from .query import Q
+from .pagination import FBOPaginator
 from .baking import bake, Bakeable, BakeableTemplateView
+from .views import ConditionalResponseMixin, RenderCacheMixin
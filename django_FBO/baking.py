@@ -12,10 +12,330 @@ from django.urls.resolvers import (
 from django.template.response import SimpleTemplateResponse
 from django.test import RequestFactory
 from django.views.generic import TemplateView
+import collections
+import concurrent.futures
+import hashlib
 import os
 import os.path
+import shutil
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows.
+    fcntl = None
+
+from . import dependencies, parallel
+from .compression import Compression, remove_siblings
+from .indexing import find_fbos
+from .manager import bake_session, export_session
+
+
+Baked = collections.namedtuple('Baked', ['changed', 'hash', 'dependencies'])
+
+
+def bake_path(path, out_fname, factory=None, record=False, previous_hash=None):
+    """
+    Render the URL path as a GET request, and write the response to
+    out_fname, returning a Baked tuple.
+
+    The response is written a chunk at a time, so streaming responses
+    (such as binaries) bake in constant memory however big they are.
+    Changed output is written to a temporary file and renamed into
+    place. If the output is identical to what's already there, we
+    leave the file alone; previous_hash is the hash of what's there
+    if you know it, otherwise we compare with the file as we go.
+
+    If record is True, dependencies is a dependencies.Recorder of
+    what went into the output.
+    """
+
+    if factory is None:
+        factory = RequestFactory()
+    os.makedirs(
+        os.path.dirname(out_fname),
+        exist_ok=True,
+    )
+    if record:
+        with dependencies.recording() as recorder:
+            changed, content_hash = _bake_path(path, out_fname, factory, previous_hash)
+        return Baked(changed, content_hash, recorder)
+    changed, content_hash = _bake_path(path, out_fname, factory, previous_hash)
+    return Baked(changed, content_hash, None)
+
+
+# How much we read at a time when comparing or hashing files.
+BLOCK_SIZE = 64 * 1024
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=20)
+
+
+def file_hash(filename):
+    """The hash of a file's content, as bake_path() works it out."""
+
+    content_hash = _new_hash()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(BLOCK_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def _bake_path(path, out_fname, factory, previous_hash):
+    match = resolve(path)
+    request = factory.get(
+        path,
+        secure=getattr(settings, 'FBO_SERVING_SECURE', False),
+        HTTP_HOST=getattr(
+            settings,
+            'FBO_SERVING_HOST',
+            'localhost',
+        ),
+    )
+    # So views can tell they're being baked.
+    request.fbo_baking = True
+    source = _get_bake_source(match, request)
+    if source is not None:
+        return _copy_output(source, out_fname)
+    response = match.func(
+        request,
+        *match.args,
+        **match.kwargs
+    )
+    if isinstance(response, SimpleTemplateResponse):
+        response.render()
+    try:
+        if response.status_code // 100 == 2:
+            if response.streaming:
+                chunks = response.streaming_content
+                size = response.get('Content-Length')
+                if size is not None:
+                    size = int(size)
+            else:
+                # FIXME: should inject a meta header into HTML
+                # so that .charset is preserved. There may be
+                # other headers on the response that are worth
+                # preserving in similar ways.
+                #
+                # Iterating gives us the chunks the response was
+                # built from, which .content would join into a copy.
+                chunks = list(response)
+                size = sum(len(chunk) for chunk in chunks)
+        else:
+            # FIXME redirects we could trap and write out
+            # either HTML files with meta refresh, or suitable
+            # configuration for Apache, nginx &c. (Or both.)
+            chunks = [
+                (
+                    "Unhandled status code %i." % response.status_code
+                ).encode('utf-8'),
+            ]
+            size = len(chunks[0])
+
+        if isinstance(chunks, list) and previous_hash is not None:
+            # We have it all in memory, so can check before touching
+            # the file at all.
+            content_hash = _new_hash()
+            for chunk in chunks:
+                content_hash.update(chunk)
+            content_hash = content_hash.hexdigest()
+            if content_hash == previous_hash and os.path.exists(out_fname):
+                return False, content_hash
+        return _write_output(out_fname, chunks, size)
+    finally:
+        # Releases any files we were streaming from.
+        response.close()
+
+
+def _write_output(out_fname, chunks, size=None):
+    # Write chunks to out_fname if they differ from what's there,
+    # returning (changed, hash). We only hold a chunk at a time in
+    # memory. While the output matches the existing file we just
+    # compare; once it doesn't, we start a temporary file with the
+    # part that did match, and carry on there. It's renamed into
+    # place at the end. size, if known, is the length of the output,
+    # which saves comparing if it's different.
+    tmp_fname = '%s.%i.tmp' % (out_fname, os.getpid())
+    content_hash = _new_hash()
+    matched = 0
+    existing = None
+    out = None
+    try:
+        try:
+            if size is None or os.stat(out_fname).st_size == size:
+                existing = open(out_fname, 'rb')
+        except OSError:
+            pass
+        if existing is None:
+            out = open(tmp_fname, 'wb')
+        for chunk in chunks:
+            content_hash.update(chunk)
+            if out is None:
+                if existing.read(len(chunk)) == chunk:
+                    matched += len(chunk)
+                    continue
+                out = _diverge(existing, matched, tmp_fname)
+            out.write(chunk)
+        if out is None and existing.read(1):
+            # What was there is longer.
+            out = _diverge(existing, matched, tmp_fname)
+        if out is not None:
+            out.close()
+            os.replace(tmp_fname, out_fname)
+    except BaseException:
+        if out is not None:
+            out.close()
+            if os.path.exists(tmp_fname):
+                os.unlink(tmp_fname)
+        raise
+    finally:
+        if existing is not None:
+            existing.close()
+    return out is not None, content_hash.hexdigest()
+
+
+def _get_bake_source(match, request):
+    # Ask a Bakeable view if the output is a copy of a file.
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is None or not issubclass(view_class, Bakeable):
+        return None
+    if view_class.get_bake_source is Bakeable.get_bake_source:
+        # It'll never have one, so don't bother setting it up.
+        return None
+    view = view_class(**match.func.view_initkwargs)
+    # As View.setup() does, which we can't use before Django 2.2.
+    view.request = request
+    view.args = match.args
+    view.kwargs = match.kwargs
+    return view.get_bake_source()
+
+
+def _copy_output(source, out_fname):
+    # Copy the file source to out_fname, unless it's there already
+    # (going by size and modification time, which we copy over),
+    # returning (changed, hash). We don't read the file to hash it,
+    # so the hash is None.
+    source_stat = os.stat(source)
+    try:
+        out_stat = os.stat(out_fname)
+    except FileNotFoundError:
+        pass
+    else:
+        if (
+            out_stat.st_size == source_stat.st_size and
+            out_stat.st_mtime_ns == source_stat.st_mtime_ns
+        ):
+            return False, None
+
+    tmp_fname = '%s.%i.tmp' % (out_fname, os.getpid())
+    try:
+        if not (
+            getattr(settings, 'FBO_BAKE_HARDLINKS', False) and
+            _link(source, tmp_fname)
+        ):
+            _clone(source, tmp_fname)
+            os.utime(
+                tmp_fname,
+                ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns),
+            )
+        os.replace(tmp_fname, out_fname)
+    except BaseException:
+        if os.path.exists(tmp_fname):
+            os.unlink(tmp_fname)
+        raise
+    return True, None
+
+
+def _link(source, dest):
+    # Hard link dest to source, if we can.
+    try:
+        os.link(source, dest)
+    except OSError:
+        # Probably on different filesystems.
+        return False
+    return True
+
+
+# From linux/fs.h: make the destination share the source's storage.
+FICLONE = 0x40049409
+
+
+def _clone(source, dest):
+    # Copy source to dest as cheaply as the OS allows: sharing the
+    # data if the filesystem supports it (btrfs, XFS and so on), or
+    # copying within the kernel, or failing that by reading and
+    # writing it.
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), BLOCK_SIZE * 16):
+                    pass
+                return
+            except OSError:
+                # Not supported here; start again.
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, BLOCK_SIZE)
+
+
+def _diverge(existing, matched, tmp_fname):
+    # Start a temporary file with the first matched bytes of existing.
+    out = open(tmp_fname, 'wb')
+    existing.seek(0)
+    while matched > 0:
+        block = existing.read(min(BLOCK_SIZE, matched))
+        out.write(block)
+        matched -= len(block)
+    return out
+
+
+def _bake_paths(output_dir, items, record=False, compression=None):
+    # Bakes (path, output name, previous hash) tuples, returning
+    # (output name, changed, manifest entry, compressed siblings
+    # written, siblings removed) for each. Runs in the worker for
+    # parallel bakes, where it joins the session the worker joined
+    # when it started (see parallel.get_executor()), so the worker
+    # only scans once, and sees the same trees as the parent.
+    factory = RequestFactory()
+    results = []
+    with bake_session():
+        for path, name, previous_hash in items:
+            out_fname = os.path.join(output_dir, name)
+            baked = bake_path(
+                path,
+                out_fname,
+                factory,
+                record,
+                previous_hash,
+            )
+            if record:
+                entry = baked.dependencies.as_dict(path)
+            else:
+                entry = {'path': path}
+            entry['hash'] = baked.hash
+            if compression is not None:
+                # While it's still in the page cache.
+                written, removed = compression.update(out_fname, baked.changed)
+            else:
+                written, removed = [], []
+            results.append((
+                name,
+                baked.changed,
+                entry,
+                [name + suffix for suffix in written],
+                [name + suffix for suffix in removed],
+            ))
+    return results
+
 
 class Bakeable:
     """A CBV that can be baked. This is pretty abstract."""
@@ -40,52 +360,19 @@ class Bakeable:
         for path in paths:
             if verbosity > 2:
                 stdout.write(" * %s\n" % str(path))
-            filename = self.get_filename(path)
-            out_fname = os.path.join(output_dir, filename)
-            os.makedirs(
-                os.path.dirname(out_fname),
-                exist_ok=True,
+            bake_path(
+                path,
+                os.path.join(output_dir, self.get_filename(path)),
+                factory,
             )
-            with open(out_fname, 'wb') as f:
-                match = resolve(path)
-                request = factory.get(
-                    path,
-                    secure=getattr(settings, 'FBO_SERVING_SECURE', False),
-                    HTTP_HOST=getattr(
-                        settings,
-                        'FBO_SERVING_HOST',
-                        'localhost',
-                    ),
-                )
-                response = match.func(
-                    request,
-                    *match.args,
-                    **match.kwargs
-                )
-                if isinstance(response, SimpleTemplateResponse):
-                    response.render()
-                if response.status_code // 100 == 2:
-                    if response.streaming:
-                        # FIXME: do something with this.
-                        f.write(
-                            "Unhandled: streaming responses.".encode('utf-8'),
-                        )
-                        pass
-                    else:
-                        # FIXME: should inject a meta header into HTML
-                        # so that .charset is preserved. There may be
-                        # other headers on the response that are worth
-                        # preserving in similar ways.
-                        f.write(response.content)
-                else:
-                    # FIXME redirects we could trap and write out
-                    # either HTML files with meta refresh, or suitable
-                    # configuration for Apache, nginx &c. (Or both.)
-                    f.write(
-                        (
-                            "Unhandled status code %i." % response.status_code
-                        ).encode('utf-8'),
-                    )
+
+    def get_bake_source(self):
+        """
+        Return the name of a file to copy as the output for the
+        request set up on this view, or None to render it as usual.
+        """
+
+        return None
 
     def get_filename(self, path):
         # FIXME: won't work with non-Unixoid file names.
@@ -123,14 +410,371 @@ class BakeableTemplateView(Bakeable, TemplateView):
     pass
 
 
-def bake(output_dir=None, resolver=None, verbosity=0, stdout=sys.stdout):
+def bake(
+    output_dir=None,
+    resolver=None,
+    verbosity=0,
+    stdout=sys.stdout,
+    jobs=None,
+    manifest=None,
+    incremental=False,
+    compress=None,
+    shard=None,
+    resume=False,
+):
+    """
+    Bake every Bakeable view in resolver (defaults to the root URL
+    configuration) into output_dir (defaults to settings.FBO_BUILD_DIR).
+
+    With jobs > 1, render pages across that many worker processes.
+
+    If manifest is the name of a file, record there what each output
+    depends on, and a hash of its content. With incremental, only bake
+    outputs whose dependencies have changed since then (or that are
+    new); the manifest defaults to .fbo-manifest.json in output_dir.
+    See django_FBO.dependencies.
+
+    Files are only written if their content has changed. With a
+    manifest, outputs that we no longer bake are removed.
+
+    With compress (which defaults to settings.FBO_BAKE_COMPRESS),
+    write compressed siblings of changed outputs for front-end
+    servers to use. It can also be a compression.Compression, to
+    configure which files get compressed.
+
+    If shard is (index, shards), only bake the outputs in that shard
+    (numbered from 1) of the plan; see shard_of(). The manifest then
+    defaults to one just for this shard in output_dir, and only
+    covers its outputs. Combine them with merge_manifests().
+
+    As outputs are baked they're written to a journal in output_dir
+    every CHECKPOINT_SIZE outputs or so, which is removed once the bake
+    is complete. If a bake doesn't finish, bake again with resume to
+    skip outputs in the journal whose dependencies haven't changed
+    since. (Use the same options as the unfinished bake.) Outputs
+    changed by the unfinished bake are included in the BakeReport.
+
+    Returns a BakeReport listing the output files changed and removed,
+    relative to output_dir.
+
+    Everything is baked within a single bake_session() (see
+    django_FBO.manager), so each tree is scanned just once and every
+    page is rendered from the same snapshot of it.
+    """
+
+    with bake_session(find_fbos(resolver)):
+        return _bake(
+            output_dir,
+            resolver,
+            verbosity,
+            stdout,
+            jobs,
+            manifest,
+            incremental,
+            compress,
+            shard,
+            resume,
+        )
+
+
+def _bake(
+    output_dir,
+    resolver,
+    verbosity,
+    stdout,
+    jobs,
+    manifest,
+    incremental,
+    compress,
+    shard,
+    resume,
+):
+    if output_dir is None:
+        output_dir = settings.FBO_BUILD_DIR
+    if shard is not None and manifest is None:
+        manifest = os.path.join(
+            output_dir,
+            dependencies.shard_manifest_name(*shard),
+        )
+    if incremental and manifest is None:
+        manifest = os.path.join(output_dir, dependencies.MANIFEST_NAME)
+    if manifest is not None:
+        manifest = dependencies.Manifest(manifest)
+
+    plan = plan_bake(resolver, verbosity, stdout)
+    if shard is not None:
+        plan = plan.shard(*shard)
+        if verbosity > 0:
+            stdout.write(
+                "Baking shard %i of %i (%i files).\n" % (shard + (len(plan),))
+            )
+    outputs = {entry.filename: entry.path for entry in plan}
+
+    if shard is None:
+        journal = dependencies.JOURNAL_NAME
+    else:
+        journal = dependencies.shard_journal_name(*shard)
+    journal = dependencies.Journal(os.path.join(output_dir, journal), resume)
+    try:
+        report = _bake_outputs(
+            output_dir,
+            outputs,
+            verbosity,
+            stdout,
+            jobs,
+            manifest,
+            incremental,
+            compress,
+            shard,
+            journal,
+        )
+    except BaseException:
+        journal.close()
+        raise
+    journal.close(remove=True)
+    return report
+
+
+# How many outputs to bake between checkpoints.
+CHECKPOINT_SIZE = 50
+
+
+def _bake_outputs(
+    output_dir,
+    outputs,
+    verbosity,
+    stdout,
+    jobs,
+    manifest,
+    incremental,
+    compress,
+    shard,
+    journal,
+):
+    items = []
+    unchanged = []
+    resumed = []
+    for name, path in outputs.items():
+        out_fname = os.path.join(output_dir, name)
+        if journal.is_current(name, path, out_fname):
+            resumed.append(name)
+        elif incremental and manifest.is_current(name, path, out_fname):
+            unchanged.append(name)
+        else:
+            if verbosity > 2:
+                stdout.write(" * %s\n" % str(path))
+            if manifest is not None:
+                previous_hash = manifest.outputs.get(name, {}).get('hash')
+            else:
+                previous_hash = None
+            items.append((path, name, previous_hash))
+    if resumed and verbosity > 0:
+        stdout.write(
+            "Resuming: %i of %i pages were already baked.\n" % (
+                len(resumed),
+                len(outputs),
+            )
+        )
+    if incremental and verbosity > 0:
+        stdout.write(
+            "Baking %i of %i pages (the rest are unchanged).\n" % (
+                len(items),
+                len(outputs),
+            )
+        )
+
+    # The journal needs dependencies, even without a manifest.
+    record = True
+    compression = Compression.from_settings(compress)
+    checkpoints = -(-len(items) // CHECKPOINT_SIZE)
+    if jobs is None or jobs <= 1:
+        for items_shard in parallel.shard(items, checkpoints):
+            journal.add(
+                _bake_paths(output_dir, items_shard, record, compression),
+            )
+    else:
+        with parallel.get_executor(jobs, export_session()) as executor:
+            futures = [
+                executor.submit(
+                    _bake_paths,
+                    output_dir,
+                    items_shard,
+                    record,
+                    compression,
+                )
+                # Several shards per worker evens out the load when
+                # some pages are much more work than others.
+                for items_shard in parallel.shard(
+                    items,
+                    max(jobs * 4, checkpoints),
+                )
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                # Raises any exception from the worker.
+                journal.add(future.result())
+    results = [
+        journal.results[name]
+        for name in resumed + [item[1] for item in items]
+    ]
+
+    changed = []
+    removed = []
+    for name, _changed, entry, written, uncompressed in results:
+        if _changed:
+            changed.append(name)
+        changed.extend(written)
+        removed.extend(uncompressed)
+    if manifest is not None:
+        stale = set(manifest.outputs) - set(outputs)
+        if shard is not None:
+            # Other shards' outputs are up to them.
+            stale = {name for name in stale if shard_of(name, shard[1]) == shard[0]}
+        for name in sorted(stale):
+            for suffix in remove_siblings(os.path.join(output_dir, name)):
+                removed.append(name + suffix)
+            if _remove_output(output_dir, name):
+                removed.append(name)
+        entries = {name: manifest.outputs[name] for name in unchanged}
+        entries.update(
+            (result[0], result[2]) for result in results
+        )
+        manifest.outputs = entries
+        manifest.save()
+    if verbosity > 0:
+        stdout.write(
+            "%i files changed, %i removed.\n" % (len(changed), len(removed)),
+        )
+    return BakeReport(sorted(changed), sorted(removed))
+
+
+BakeReport = collections.namedtuple('BakeReport', ['changed', 'removed'])
+
+
+PlanEntry = collections.namedtuple('PlanEntry', ['path', 'view', 'filename'])
+
+
+class BakePlan:
+    """
+    Everything a bake will render: a PlanEntry for each output file
+    (relative to the output directory), giving the URL path rendered
+    to it and the view instance that came up with that path.
+
+    There's only ever one entry per file; if a path is added for a
+    file we already have, it replaces the earlier one (which is kept
+    in duplicates).
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.duplicates = []
+
+    def add(self, path, view, filename):
+        previous = self.entries.get(filename)
+        if previous is not None:
+            self.duplicates.append(previous)
+        self.entries[filename] = PlanEntry(path, view, filename)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def shard(self, index, shards):
+        """Return a BakePlan of just our entries in the given shard."""
+
+        plan = BakePlan()
+        for entry in self:
+            if shard_of(entry.filename, shards) == index:
+                plan.entries[entry.filename] = entry
+        return plan
+
+    def counts(self):
+        """Return an ordered dict of view class name -> entries."""
+
+        counts = collections.OrderedDict()
+        for entry in self:
+            label = _view_label(entry.view)
+            counts[label] = counts.get(label, 0) + 1
+        return counts
+
+    def describe(self, stdout=sys.stdout, verbosity=1):
+        """Write out a summary of the plan (and, with verbosity > 1, each entry)."""
+
+        if verbosity > 1:
+            for entry in self:
+                stdout.write("%s <- %s\n" % (entry.filename, entry.path))
+        for label, count in self.counts().items():
+            stdout.write("%6i %s\n" % (count, label))
+        total = "%6i files in total" % len(self)
+        if self.duplicates:
+            total += " (%i duplicates skipped)" % len(self.duplicates)
+        # Management commands' stdout ends every write with a newline.
+        stdout.write(total + ".\n")
+
+
+def shard_of(name, shards):
+    """
+    Return which of shards (numbered from 1) the output file name
+    goes in. This is stable across runs and machines, and spreads
+    outputs evenly however they're named.
+    """
+
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards + 1
+
+
+def _view_label(view):
+    return '%s.%s' % (type(view).__module__, type(view).__qualname__)
+
+
+def plan_bake(resolver=None, verbosity=0, stdout=sys.stdout):
+    """
+    Work out what to bake for the Bakeable views in resolver (defaults
+    to the root URL configuration), without rendering anything.
+    Returns a BakePlan.
+    """
+
+    plan = BakePlan()
+    for view_instance, paths in _find_bakeables(resolver, verbosity, stdout):
+        if paths is None:
+            if verbosity > 1:
+                stdout.write(" > fetching paths (in %s)\n" % str(view_instance))
+            paths = view_instance.get_paths()
+        for path in paths:
+            plan.add(path, view_instance, view_instance.get_filename(path))
+    return plan
+
+
+def _remove_output(output_dir, name):
+    # Remove a file we baked previously, and any directories that
+    # leaves empty. Returns whether there was anything to remove.
+    out_fname = os.path.join(output_dir, name)
+    try:
+        os.unlink(out_fname)
+    except FileNotFoundError:
+        return False
+    directory = os.path.dirname(out_fname)
+    while os.path.abspath(directory) != os.path.abspath(output_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty.
+            break
+        directory = os.path.dirname(directory)
+    return True
+
+
+def _find_bakeables(resolver=None, verbosity=0, stdout=sys.stdout):
+    # Yields (view instance, paths) for each Bakeable view, where
+    # paths of None means all of the view's own paths.
     if resolver is None:
         resolver = get_resolver()
     if verbosity > 1:
         stdout.write("Baking %s\n" % str(resolver))
     if isinstance(resolver, URLResolver):
         for up in resolver.url_patterns:
-            bake(output_dir, up, verbosity, stdout)
+            yield from _find_bakeables(up, verbosity, stdout)
     elif isinstance(resolver, URLPattern):
         view = resolver.callback
         # `view` is a callable, but it may also be
@@ -150,23 +794,12 @@ def bake(output_dir=None, resolver=None, verbosity=0, stdout=sys.stdout):
                     # to work; otherwise we SILENTLY do nothing, which
                     # isn't friendly.
                     #
-                    # Note this may mean that we write something out
-                    # twice. This really shouldn't cause problems,
-                    # although it probably will at some point.
+                    # Note this may mean that the view comes up with
+                    # the same path again; BakePlan deals with that.
                     if resolver.name is not None:
-                        view_instance.bake(
-                            output_dir,
-                            [reverse(resolver.name)],
-                            verbosity,
-                            stdout,
-                        )
+                        yield view_instance, [reverse(resolver.name)]
                 else:
-                    view_instance.bake(
-                        output_dir,
-                        None,
-                        verbosity,
-                        stdout,
-                    )
+                    yield view_instance, None
             else:
                 if verbosity > 0:
                     stdout.write(" ! skipping %s\n" % str(view))
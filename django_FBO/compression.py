@@ -0,0 +1,182 @@
+"""
+Precompressed copies of baked files.
+
+Front-end servers can send a compressed sibling of a file instead of
+compressing it on every request (nginx's gzip_static and
+brotli_static, for instance, look for page.html.gz and page.html.br
+next to page.html). Baking can write these as it goes, for files
+that have changed; see bake(compress=...).
+
+Brotli is only used if the brotli package is installed.
+
+Settings:
+
+FBO_BAKE_COMPRESS: compress when baking (default False)
+FBO_BAKE_COMPRESS_EXTENSIONS: which files to compress, by extension
+FBO_BAKE_COMPRESS_MIN_SIZE: don't compress files smaller than this
+"""
+
+from django.conf import settings
+import gzip
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+BLOCK_SIZE = 64 * 1024
+
+DEFAULT_EXTENSIONS = (
+    '.html', '.css', '.js', '.json', '.xml', '.txt', '.svg',
+)
+# Below this, compression doesn't save enough to be worth it.
+DEFAULT_MIN_SIZE = 1024
+
+
+def _gzip(src, dst):
+    # No name or timestamp in the header, so the same input always
+    # gives the same output.
+    with gzip.GzipFile(filename='', mode='wb', fileobj=dst, mtime=0) as gz:
+        shutil.copyfileobj(src, gz, BLOCK_SIZE)
+
+
+def _brotli(src, dst):
+    compressor = brotli.Compressor()
+    for chunk in iter(lambda: src.read(BLOCK_SIZE), b''):
+        dst.write(compressor.process(chunk))
+    dst.write(compressor.finish())
+
+
+# Suffix -> compressor.
+ENCODINGS = {
+    '.gz': _gzip,
+    '.br': _brotli,
+}
+
+
+def get_encodings():
+    """Return the suffixes for the encodings we can write here."""
+
+    return [
+        suffix for suffix in ENCODINGS
+        if suffix != '.br' or brotli is not None
+    ]
+
+
+class Compression:
+    """
+    How to compress baked files. extensions and min_size default to
+    the settings, and then to DEFAULT_EXTENSIONS and DEFAULT_MIN_SIZE.
+
+    This gets sent to worker processes for parallel bakes, so it
+    mustn't hold on to anything that can't be pickled.
+    """
+
+    def __init__(self, extensions=None, min_size=None):
+        if extensions is None:
+            extensions = getattr(
+                settings,
+                'FBO_BAKE_COMPRESS_EXTENSIONS',
+                DEFAULT_EXTENSIONS,
+            )
+        if min_size is None:
+            min_size = getattr(
+                settings,
+                'FBO_BAKE_COMPRESS_MIN_SIZE',
+                DEFAULT_MIN_SIZE,
+            )
+        self.extensions = tuple(extensions)
+        self.min_size = min_size
+        self.encodings = get_encodings()
+
+    @classmethod
+    def from_settings(cls, compress=None):
+        """
+        Return a Compression for bake(compress=...), which is either
+        a Compression already, True or False, or None to follow
+        settings.FBO_BAKE_COMPRESS. Returns None for no compression.
+        """
+
+        if compress is None:
+            compress = getattr(settings, 'FBO_BAKE_COMPRESS', False)
+        if isinstance(compress, cls):
+            return compress
+        return cls() if compress else None
+
+    def wants(self, filename):
+        """Should filename be compressed?"""
+
+        if os.path.splitext(filename)[1] not in self.extensions:
+            return False
+        try:
+            return os.stat(filename).st_size >= self.min_size
+        except OSError:
+            return False
+
+    def update(self, filename, changed=True):
+        """
+        Bring the compressed siblings of filename up to date, given
+        whether filename has just changed. Returns the suffixes of the
+        siblings written, and of those removed because filename
+        shouldn't be compressed any more.
+
+        Siblings have the same modification time as filename when we
+        write them, so if that's different now (say because a bake was
+        interrupted after changing filename but before compressing
+        it), they're written again even if filename hasn't changed.
+        """
+
+        written = []
+        removed = []
+        if not self.wants(filename):
+            if changed:
+                removed = remove_siblings(filename)
+            return written, removed
+        mtime = os.stat(filename).st_mtime_ns
+        for suffix in self.encodings:
+            sibling = filename + suffix
+            if changed or _mtime(sibling) != mtime:
+                self.compress(filename, suffix)
+                written.append(suffix)
+        return written, removed
+
+    def compress(self, filename, suffix):
+        """Write the sibling of filename with the given suffix."""
+
+        sibling = filename + suffix
+        tmp_fname = '%s.%i.tmp' % (sibling, os.getpid())
+        try:
+            with open(filename, 'rb') as src, open(tmp_fname, 'wb') as dst:
+                ENCODINGS[suffix](src, dst)
+            shutil.copystat(filename, tmp_fname)
+            os.replace(tmp_fname, sibling)
+        except BaseException:
+            if os.path.exists(tmp_fname):
+                os.unlink(tmp_fname)
+            raise
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def remove_siblings(filename):
+    """
+    Remove any compressed siblings of filename, returning the suffixes
+    of those there were.
+    """
+
+    removed = []
+    for suffix in ENCODINGS:
+        try:
+            os.unlink(filename + suffix)
+        except FileNotFoundError:
+            continue
+        removed.append(suffix)
+    return removed
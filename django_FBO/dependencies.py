@@ -0,0 +1,418 @@
+"""
+Tracking what baked pages depend on, for incremental baking.
+
+While a page is rendered for baking, we record:
+
+ * the source files it used (any FileObject whose metadata, content
+   or stat data was looked at), with their fingerprints, and
+ * the querysets it evaluated, as a description we can rebuild the
+   FBO from, with a digest of the names of the objects that came
+   back, in order.
+
+Looking at objects in order to filter or sort them doesn't count as
+using them; if that changes the results, the query digest will show
+it. So an index page depends on the posts it shows, and on which
+posts there are, but not on the content of every post.
+
+The records for a bake are kept in a Manifest. On the next bake, a
+page needs rendering again if any of its sources have changed, or if
+any of its querysets now give different results (for instance because
+a post was added or removed). Everything else is left alone.
+
+We don't track templates, code or settings, so do a full bake if you
+change any of those. Querysets are re-evaluated as recorded, so
+anything else a view works out for itself at render time (such as
+which posts are in the future) won't be noticed either.
+"""
+
+import contextlib
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import threading
+
+from .query import Q
+
+
+MANIFEST_NAME = '.fbo-manifest.json'
+
+
+JOURNAL_NAME = '.fbo-journal.jsonl'
+
+
+def shard_manifest_name(index, shards):
+    """The default manifest name for one shard of a sharded bake."""
+
+    return '.fbo-manifest.%i-of-%i.json' % (index, shards)
+
+
+def shard_journal_name(index, shards):
+    """The journal name for one shard of a sharded bake."""
+
+    return '.fbo-journal.%i-of-%i.jsonl' % (index, shards)
+
+
+_local = threading.local()
+
+
+class Recorder:
+    """What one page depends on."""
+
+    def __init__(self):
+        self.sources = {}
+        self.queries = {}
+        self.volatile = False
+        self.suppressed = 0
+
+    def as_dict(self, path):
+        return {
+            'path': path,
+            'sources': self.sources,
+            'queries': [
+                [spec, digest]
+                for _, (spec, digest) in sorted(self.queries.items())
+            ],
+            'volatile': self.volatile,
+        }
+
+
+def _current():
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None or recorder.suppressed:
+        return None
+    return recorder
+
+
+@contextlib.contextmanager
+def recording():
+    """Record dependencies within this block, into a new Recorder."""
+
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = Recorder()
+    try:
+        yield _local.recorder
+    finally:
+        _local.recorder = previous
+
+
+@contextlib.contextmanager
+def suppressed():
+    """Don't record anything within this block."""
+
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        yield
+        return
+    recorder.suppressed += 1
+    try:
+        yield
+    finally:
+        recorder.suppressed -= 1
+
+
+def record_source(obj):
+    """Note that the FileObject obj has been used."""
+
+    recorder = _current()
+    if recorder is None or obj.path in recorder.sources:
+        return
+    with suppressed():
+        recorder.sources[obj.path] = obj.fingerprint
+
+
+def digest_objects(objects):
+    """A digest of the names of objects, in order."""
+
+    names = hashlib.blake2b(digest_size=16)
+    for obj in objects:
+        names.update(obj.name.encode('utf-8'))
+        names.update(b'\0')
+    return names.hexdigest()
+
+
+def record_query(fbo, objects=None, digest=None):
+    """
+    Note that the FBO fbo was evaluated, giving objects (or results
+    with the given digest, from digest_objects()).
+    """
+
+    recorder = _current()
+    if recorder is None:
+        return
+    try:
+        spec = encode_query(fbo)
+    except TypeError:
+        # We'd never be able to check it, so always rebake.
+        recorder.volatile = True
+        return
+    if digest is None:
+        digest = digest_objects(objects)
+    recorder.queries[json.dumps(spec, sort_keys=True)] = (spec, digest)
+
+
+def encode_query(fbo):
+    """
+    Describe an FBO in JSON-compatible terms, so that decode_query()
+    can build an equivalent one later. Raises TypeError if we can't.
+    """
+
+    from .manager import OPTS
+    return {
+        'class': _encode(type(fbo)),
+        'opts': {
+            # Cached objects aren't part of what the FBO means.
+            opt: _encode(getattr(fbo, opt))
+            for opt in OPTS if opt not in ('_fetched', '_subset')
+        },
+    }
+
+
+def decode_query(spec):
+    fbo_class = _decode(spec['class'])
+    return fbo_class(**{
+        opt: _decode(value) for opt, value in spec['opts'].items()
+    })
+
+
+def _encode(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return {'list': [_encode(v) for v in value]}
+    if isinstance(value, Q):
+        return {
+            'q': [
+                'AND' if value.connector is Q.AND else 'OR',
+                value.negated,
+                [
+                    _encode(child) if isinstance(child, Q)
+                    # A (lookup, value) tuple.
+                    else [child[0], _encode(child[1])]
+                    for child in value.children
+                ],
+            ],
+        }
+    if isinstance(value, slice):
+        return {'slice': [value.start, value.stop, value.step]}
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    if isinstance(value, type) and '<locals>' not in value.__qualname__:
+        return {'class': [value.__module__, value.__qualname__]}
+    raise TypeError("Can't encode %r for the manifest." % (value,))
+
+
+def _decode(value):
+    if not isinstance(value, dict):
+        return value
+    (kind, value), = value.items()
+    if kind == 'list':
+        return [_decode(v) for v in value]
+    if kind == 'q':
+        connector, negated, children = value
+        return Q(
+            *[
+                _decode(child) if isinstance(child, dict)
+                else (child[0], _decode(child[1]))
+                for child in children
+            ],
+            _connector=Q.AND if connector == 'AND' else Q.OR,
+            _negated=negated
+        )
+    if kind == 'slice':
+        return slice(*value)
+    if kind == 'datetime':
+        return datetime.datetime.fromisoformat(value)
+    if kind == 'date':
+        return datetime.date.fromisoformat(value)
+    if kind == 'class':
+        module, qualname = value
+        obj = importlib.import_module(module)
+        for attr in qualname.split('.'):
+            obj = getattr(obj, attr)
+        return obj
+    raise ValueError("Unknown manifest value '%s'." % kind)
+
+
+class Manifest:
+    """
+    The dependencies of each output of a bake, keyed on filename
+    relative to the output directory, kept in a JSON file.
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.outputs = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if isinstance(data, dict) and data.get('version') == self.version:
+            self.outputs = data.get('outputs', {})
+        # Worked out on demand, and shared between outputs.
+        self._fingerprints = {}
+        self._digests = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(
+                {
+                    'version': self.version,
+                    'outputs': self.outputs,
+                },
+                f,
+                sort_keys=True,
+            )
+        os.replace(tmp_filename, self.filename)
+
+    def is_current(self, name, path, out_fname):
+        """
+        Is the output name, baked from the URL path to out_fname, up
+        to date with what it depends on?
+        """
+
+        entry = self.outputs.get(name)
+        if (
+            entry is None or
+            entry['volatile'] or
+            entry['path'] != path or
+            not os.path.exists(out_fname)
+        ):
+            return False
+        for source, fingerprint in entry['sources'].items():
+            if self._fingerprint(source) != fingerprint:
+                return False
+        for spec, digest in entry['queries']:
+            if self._digest(spec) != digest:
+                return False
+        return True
+
+    def _fingerprint(self, source):
+        from .file_objects import stat_fingerprint
+        if source not in self._fingerprints:
+            try:
+                stat = os.stat(source)
+            except OSError:
+                fingerprint = None
+            else:
+                fingerprint = stat_fingerprint(stat)
+            self._fingerprints[source] = fingerprint
+        return self._fingerprints[source]
+
+    def _digest(self, spec):
+        # We're called during a bake, so every query on a tree shares
+        # a single scan of it; see django_FBO.manager.bake_session().
+        key = json.dumps(spec, sort_keys=True)
+        if key not in self._digests:
+            try:
+                fbo = decode_query(spec)
+            except (ImportError, AttributeError, TypeError, ValueError):
+                # The FBO has gone away or changed incompatibly.
+                self._digests[key] = None
+            else:
+                self._digests[key] = digest_objects(fbo)
+        return self._digests[key]
+
+
+class Journal(Manifest):
+    """
+    The outputs of a bake so far, so that if it doesn't finish it
+    can be resumed. Each line of the file is the JSON for a list of
+    [output name, changed, manifest entry, compressed siblings written,
+    siblings removed] for one output.
+
+    With resume, we start from what's in the file already; outputs
+    are done if is_current() says so. Otherwise we start afresh.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.results = {}
+        if resume:
+            try:
+                with open(filename) as f:
+                    for line in f:
+                        try:
+                            result = json.loads(line)
+                        except ValueError:
+                            # Cut off part way through writing it.
+                            break
+                        self.results[result[0]] = result
+            except OSError:
+                pass
+        self.outputs = {
+            name: result[2] for name, result in self.results.items()
+        }
+        self._fingerprints = {}
+        self._digests = {}
+
+        # Start the file again with what we're keeping, so there's
+        # nothing half-written in it, and append from there.
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            for result in self.results.values():
+                f.write(json.dumps(result, sort_keys=True) + '\n')
+        os.replace(tmp_filename, filename)
+        self._file = open(filename, 'a')
+
+    def add(self, results):
+        """
+        Add results from baking outputs, and make sure they're on disk.
+        Anything changed when an output was baked before counts as
+        changed now, since it may not have been published yet.
+        """
+
+        for name, changed, entry, written, removed in results:
+            earlier = self.results.get(name)
+            if earlier is not None:
+                changed = changed or earlier[1]
+                written = sorted(set(written) | set(earlier[3]))
+                removed = sorted(set(removed) | set(earlier[4]))
+            result = [name, changed, entry, written, removed]
+            self.results[name] = result
+            self.outputs[name] = entry
+            self._file.write(json.dumps(result, sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def save(self):
+        # We're saved as we go.
+        pass
+
+    def close(self, remove=False):
+        """Close the journal, removing it if the bake finished."""
+
+        self._file.close()
+        if remove:
+            os.unlink(self.filename)
+
+
+def merge_manifests(filename, sources):
+    """
+    Combine the Manifests in the files sources (such as those from the
+    shards of a bake) into a new one saved as filename, and return it.
+    """
+
+    merged = Manifest(filename)
+    merged.outputs = {}
+    for source in sources:
+        if not os.path.exists(source):
+            raise FileNotFoundError("No manifest '%s'." % source)
+        outputs = Manifest(source).outputs
+        clashes = set(outputs) & set(merged.outputs)
+        if clashes:
+            raise ValueError(
+                "'%s' is in more than one manifest." % min(clashes),
+            )
+        merged.outputs.update(outputs)
+    merged.save()
+    return merged
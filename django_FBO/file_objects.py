@@ -1,11 +1,42 @@
+from django.conf import settings
 from django.core.exceptions import (
     ObjectDoesNotExist,
     MultipleObjectsReturned,
 )
 from django.db.models.fields import TextField
+from django.utils import timezone
+from collections import OrderedDict
+import copy
+import datetime
+import hashlib
 import json
+import os
+import threading
 import yaml
 
+from . import dependencies
+
+# Prefer the C implementations where available; they're several
+# times faster than the pure-Python ones.
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Parsed metadata, keyed by a digest of the header blob, so that
+# unchanged files don't hit the parsers again when we rescan. It holds
+# at most FBO_METADATA_CACHE_SIZE entries (None for no limit), least
+# recently used going first, so stale ones don't build up. Rescans go
+# through files in order, so a limit smaller than the tree means
+# nothing is ever reused; raise it if your trees are bigger.
+DEFAULT_METADATA_CACHE_SIZE = 10000
+_parsed_heads = OrderedDict()
+_parsed_heads_lock = threading.Lock()
+
 
 class Options:
     verbose_name = None
@@ -48,8 +79,94 @@ class FileObjectMeta(type):
         return new_class
 
 
+def _parse_blob(loads, blob):
+    key = (
+        loads,
+        hashlib.blake2b(blob.encode('utf-8'), digest_size=16).digest(),
+    )
+    with _parsed_heads_lock:
+        try:
+            data = _parsed_heads[key]
+            _parsed_heads.move_to_end(key)
+            hit = True
+        except KeyError:
+            hit = False
+    if not hit:
+        data = loads(blob)
+        limit = getattr(
+            settings,
+            'FBO_METADATA_CACHE_SIZE',
+            DEFAULT_METADATA_CACHE_SIZE,
+        )
+        with _parsed_heads_lock:
+            _parsed_heads[key] = data
+            while limit is not None and len(_parsed_heads) > limit:
+                _parsed_heads.popitem(last=False)
+    # Callers get their own copy, since metadata is mutable.
+    return copy.deepcopy(data)
+
+
+def _yaml_loads(blob):
+    return yaml.load(blob, Loader=YAMLLoader)
+
+
+def parse_file_head(content):
+    """
+    Split metadata off the head of `content`, returning a tuple of
+    (metadata, offset) where offset is the index into `content` at
+    which the body starts. We support explicit JSON (starting with
+    '{' on its own line), explicit YAML (between '---' lines) and
+    implicit YAML (any ':' before the first blank line).
+
+    This is a plain function rather than a method so that it can
+    be run in worker processes when building indexes in bulk.
+    """
+
+    if content.startswith('{\n'):
+        # JSON!
+        end = content.find('\n}\n')
+        if end != -1:
+            blob = content[:end+3]
+            return _parse_blob(json_loads, blob), end+3
+    elif content.startswith('---\n'):
+        # YAML!
+        # Magic numbers: 4 is skipping the intro ---\n,
+        # 8 is skipping both intro and outro ---\n.
+        end = content[4:].find('---\n')
+        if end != -1:
+            blob = content[4:end+4]
+            return _parse_blob(_yaml_loads, blob), end+8
+    else:
+        # Implicit YAML if ':' before \n\n
+        colon_idx = content.find(':')
+        sep_idx = content.find('\n\n')
+        # If sep_idx is -1 or both are, first leg won't pass
+        if colon_idx < sep_idx and colon_idx != -1:
+            # YAML!
+            blob = content[:sep_idx]
+            return _parse_blob(_yaml_loads, blob), sep_idx+2
+    return {}, 0
+
+
+def _datetime_from_timestamp(ts):
+    if settings.USE_TZ:
+        return datetime.datetime.fromtimestamp(ts, timezone.utc)
+    else:
+        return datetime.datetime.fromtimestamp(ts)
+
+
+def stat_fingerprint(stat):
+    """See FileObject.fingerprint."""
+
+    return '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+
+
 class FileObject(metaclass=FileObjectMeta):
     MetadataInFileHead = True
+    stat_fields = ('size', 'modified', 'created')
+    # Those of stat_fields that front matter of the same name takes
+    # precedence over. Filtering on them means reading every file.
+    stat_overrides = ()
     DoesNotExist = ObjectDoesNotExist
     MultipleObjectsReturned = MultipleObjectsReturned
 
@@ -60,6 +177,7 @@ class FileObject(metaclass=FileObjectMeta):
         name,
         slug_suffices=None,
         slug_strip_index=None,
+        stat=None,
     ):
         self.storage = storage
         self.metadata_location = metadata_location
@@ -68,6 +186,12 @@ class FileObject(metaclass=FileObjectMeta):
         self.slug_suffices = slug_suffices
         self.slug_strip_index = slug_strip_index
         self._metadata = None
+        self._content = None
+        # Usually passed down from the FBO's directory walk, so
+        # we don't need another syscall.
+        self._stat = stat
+        self._modified = None
+        self._created = None
 
     @property
     def slug(self):
@@ -108,10 +232,60 @@ class FileObject(metaclass=FileObjectMeta):
                 slug = ''
         return slug
 
+    @property
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        dependencies.record_source(self)
+        return self._stat
+
+    @property
+    def file_size(self):
+        """Size of the file in bytes."""
+
+        return self.stat.st_size
+
+    @property
+    def file_modified(self):
+        """
+        Modification time of the file, timezone aware if USE_TZ
+        (as with Django's Storage.get_modified_time()).
+        """
+
+        if self._modified is None:
+            self._modified = _datetime_from_timestamp(self.stat.st_mtime)
+        return self._modified
+
+    @property
+    def file_created(self):
+        """
+        Creation time of the file, as per Storage.get_created_time()
+        (so actually the ctime on Unix).
+        """
+
+        if self._created is None:
+            self._created = _datetime_from_timestamp(self.stat.st_ctime)
+        return self._created
+
+    @property
+    def fingerprint(self):
+        """
+        A string that changes whenever the file does, from its
+        modification time and size.
+        """
+
+        return stat_fingerprint(self.stat)
+
     @property
     def metadata(self):
+        dependencies.record_source(self)
         if self._metadata is None:
-            self._metadata = self._load_metadata()
+            if self.metadata_location == FileObject.MetadataInFileHead:
+                self._metadata = self._load_metadata()
+            else:
+                # There's nowhere we could find any, so don't read
+                # (potentially large, binary) content looking.
+                self._metadata = {}
         return self._metadata
 
     def _load_content(self):
@@ -119,46 +293,36 @@ class FileObject(metaclass=FileObjectMeta):
             return _file.read().decode('utf-8')
 
     def _load_metadata(self):
-        self.content = self._load_content()
+        content = self._load_content()
         if self.metadata_location == FileObject.MetadataInFileHead:
-            if self.content.startswith('{\n'):
-                # JSON!
-                end = self.content.find('\n}\n')
-                if end != -1:
-                    blob = self.content[:end+3]
-                    self.content = self.content[end+3:]
-                    data = json.loads(blob)
-                    return data
-            elif self.content.startswith('---\n'):
-                # YAML!
-                # Magic numbers: 4 is skipping the intro ---\n,
-                # 8 is skipping both intro and outro ---\n.
-                end = self.content[4:].find('---\n')
-                if end != -1:
-                    blob = self.content[4:end+4]
-                    self.content = self.content[end+8:]
-                    data = yaml.safe_load(blob)
-                    return data
-            else:
-                # Implicit YAML if ':' before \n\n
-                colon_idx = self.content.find(':')
-                sep_idx = self.content.find('\n\n')
-                # If sep_idx is -1 or both are, first leg won't pass
-                if colon_idx < sep_idx and colon_idx != -1:
-                    # YAML!
-                    blob = self.content[:sep_idx]
-                    self.content = self.content[sep_idx+2:]
-                    data = yaml.safe_load(blob)
-                    return data
+            data, offset = parse_file_head(content)
+            self._content = content[offset:]
+            return data
+        self._content = content
         return {}
 
+    @property
+    def content(self):
+        dependencies.record_source(self)
+        # if we are asked for content before any metadata, need to
+        # load it (or if metadata was supplied up front, see
+        # django_FBO.indexing, we still need the body).
+        if self._content is None:
+            self._metadata = self._load_metadata()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
     def __getattr__(self, key):
-        # if we are asked for content before any metadata,
-        # need to load it
-        if key == 'content':
-            self.metadata
-            return self.content
-        return self.metadata.get(key, None)
+        if key in self.stat_fields and key not in self.stat_overrides:
+            # Straight from the stat data, without reading the file.
+            return getattr(self, 'file_' + key)
+        metadata = self.metadata
+        if key in metadata or key not in self.stat_fields:
+            return metadata.get(key, None)
+        return getattr(self, 'file_' + key)
 
     def __eq__(self, other):
         if other is None or not isinstance(other, FileObject):
@@ -0,0 +1,130 @@
+"""
+Bulk index building for large FBO trees.
+
+Parsing front matter is CPU-bound, so for big trees it dominates the
+first iteration over an FBO. Here we shard the file list across a
+process pool, parse metadata in the workers, and hand back compact
+(name, metadata) records which are attached to the FileObjects in
+the parent process. Content is not kept; it'll be read as normal if
+and when something asks for it.
+
+Either warm the trees your views use when your process starts:
+
+    from django_FBO.indexing import find_fbos, warm
+    warm(find_fbos(), jobs=8)
+
+or warm everything your bakeable views use before baking via:
+
+    ./manage.py bake_site --index-jobs=8
+
+What's warmed is the scan of each tree, which every FBO on that tree
+shares (see django_FBO.manager), rather than the FBOs you pass; nothing
+is pinned to them. Files that change afterwards are parsed again as
+usual, when they're next needed.
+"""
+
+import os
+
+from django.urls import get_resolver
+from django.urls.resolvers import URLPattern, URLResolver
+
+from .file_objects import FileObject
+from .manager import FBO
+from .parallel import get_executor, shard
+
+
+def _parse_shard(storage_class, location, model, metadata_location, names):
+    # Runs in the worker. We build our own storage rather than
+    # pickling the FBO's, in the same way FBO.__init__ does.
+    storage = storage_class(location=location)
+    records = []
+    for name in names:
+        _file = model(storage, metadata_location, name)
+        records.append((name, _file._load_metadata()))
+    return records
+
+
+def build_index(fbo, names, jobs=None):
+    """
+    Parse metadata for each of `names` within `fbo`'s tree across
+    `jobs` worker processes, returning a dict of name -> metadata.
+    """
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    index = {}
+    with get_executor(jobs) as executor:
+        futures = [
+            executor.submit(
+                _parse_shard,
+                fbo.storage,
+                fbo.path,
+                fbo.model,
+                fbo.metadata,
+                names_shard,
+            )
+            # Several shards per worker evens out the load when
+            # some files are much bigger than others.
+            for names_shard in shard(names, jobs * 4)
+        ]
+        for future in futures:
+            index.update(future.result())
+    return index
+
+
+def warm(fbos, jobs=None):
+    """
+    Scan the trees of each of `fbos`, parsing metadata in bulk for
+    any objects that don't have it yet. Each tree (and model) is only
+    scanned once, however many of `fbos` are on it.
+    """
+
+    trees = {}
+    for fbo in fbos:
+        trees.setdefault(fbo._tree_key(), fbo)
+
+    for fbo in trees.values():
+        if fbo.metadata != FileObject.MetadataInFileHead:
+            continue
+        # A clone, so that we look at the current scan, shared with
+        # every other FBO on the tree, without changing fbo.
+        scanned = fbo.all()
+        scanned._fetched = None
+        scanned._prefetch()
+        names = [obj.name for obj in scanned._fetched if obj._metadata is None]
+        if not names:
+            continue
+        index = build_index(fbo, names, jobs)
+        for obj in scanned._fetched:
+            if obj.name in index:
+                obj._metadata = index[obj.name]
+
+
+def find_fbos(resolver=None):
+    """
+    Find the FBO querysets used by class-based views in the URL
+    configuration (defaulting to the root one).
+    """
+
+    if resolver is None:
+        resolver = get_resolver()
+    seen = set()
+    for fbo in _find_fbos(resolver):
+        if id(fbo) not in seen:
+            seen.add(id(fbo))
+            yield fbo
+
+
+def _find_fbos(resolver):
+    if isinstance(resolver, URLResolver):
+        for up in resolver.url_patterns:
+            yield from _find_fbos(up)
+    elif isinstance(resolver, URLPattern):
+        view = resolver.callback
+        if hasattr(view, 'view_class'):
+            queryset = view.view_initkwargs.get(
+                'queryset',
+                getattr(view.view_class, 'queryset', None),
+            )
+            if isinstance(queryset, FBO):
+                yield queryset
@@ -1,7 +1,26 @@
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+import argparse
+import os.path
 
-from ...baking import bake
+from ...baking import bake, plan_bake
+from ...dependencies import MANIFEST_NAME, merge_manifests
+from ...indexing import find_fbos, warm
+from ...manager import bake_session
+
+
+def shard(value):
+    """Parse 'i/N' into (i, N), for shard i (from 1) of N."""
+
+    try:
+        index, shards = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shards look like '2/5'.")
+    if not 1 <= index <= shards:
+        raise argparse.ArgumentTypeError(
+            "Shard %i/%i is out of range." % (index, shards),
+        )
+    return index, shards
 
 
 class Command(BaseCommand):
@@ -13,10 +32,133 @@ class Command(BaseCommand):
             nargs='?',
             help='directory to build to (defaults to %s)' % settings.FBO_BUILD_DIR,
         )
+        parser.add_argument(
+            '--index-jobs',
+            type=int,
+            default=None,
+            help='parse FBO metadata up front using this many processes',
+        )
+        parser.add_argument(
+            '--jobs', '-j',
+            type=int,
+            default=None,
+            help='render pages using this many processes',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='only bake pages whose source files have changed since the last bake',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help=(
+                "carry on from a bake that didn't finish, skipping pages "
+                'it baked whose source files have not changed since'
+            ),
+        )
+        parser.add_argument(
+            '--manifest',
+            default=None,
+            help=(
+                'file recording what each page depends on (defaults to '
+                '.fbo-manifest.json in outdir when baking incrementally)'
+            ),
+        )
+        parser.add_argument(
+            '--shard',
+            type=shard,
+            default=None,
+            metavar='I/N',
+            help=(
+                'only bake shard I of N of the site, with its own manifest '
+                '(defaults to .fbo-manifest.I-of-N.json in outdir)'
+            ),
+        )
+        parser.add_argument(
+            '--merge-manifests',
+            nargs='+',
+            default=None,
+            metavar='MANIFEST',
+            help=(
+                "don't bake, but combine these shard manifests into "
+                '--manifest (defaults to .fbo-manifest.json in outdir)'
+            ),
+        )
+        parser.add_argument(
+            '--compress',
+            action='store_true',
+            default=None,
+            help=(
+                'write gzip (and brotli, if installed) versions of changed '
+                'files (defaults to settings.FBO_BAKE_COMPRESS)'
+            ),
+        )
+        parser.add_argument(
+            '--no-compress',
+            action='store_false',
+            dest='compress',
+            help="don't write compressed versions of files",
+        )
+
+        parser.add_argument(
+            '--changed-list',
+            default=None,
+            help='write the files changed by this bake to this file, one per line',
+        )
+        parser.add_argument(
+            '--removed-list',
+            default=None,
+            help='write the files removed by this bake to this file, one per line',
+        )
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='list what would be baked, with counts per view, without baking anything',
+        )
 
     def handle(self, *args, **options):
-        bake(
+        if options['merge_manifests'] is not None:
+            manifest = options['manifest']
+            if manifest is None:
+                manifest = os.path.join(
+                    options['outdir'] or settings.FBO_BUILD_DIR,
+                    MANIFEST_NAME,
+                )
+            try:
+                merged = merge_manifests(manifest, options['merge_manifests'])
+            except (OSError, ValueError) as e:
+                raise CommandError(str(e))
+            if options['verbosity'] > 0:
+                self.stdout.write(
+                    "Merged %i outputs into %s.\n" % (len(merged.outputs), manifest),
+                )
+            return
+        if options['index_jobs']:
+            warm(find_fbos(), options['index_jobs'])
+        if options['dry_run']:
+            with bake_session(find_fbos()):
+                plan = plan_bake()
+                if options['shard'] is not None:
+                    plan = plan.shard(*options['shard'])
+                plan.describe(self.stdout, options['verbosity'])
+            return
+        report = bake(
             output_dir=options['outdir'],
             verbosity=options['verbosity'],
             stdout=self.stdout,
+            jobs=options['jobs'],
+            manifest=options['manifest'],
+            incremental=options['incremental'],
+            compress=options['compress'],
+            shard=options['shard'],
+            resume=options['resume'],
         )
+        for option, names in [
+            ('changed_list', report.changed),
+            ('removed_list', report.removed),
+        ]:
+            if options[option] is not None:
+                with open(options[option], 'w') as f:
+                    f.writelines('%s\n' % name for name in names)
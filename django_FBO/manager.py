@@ -1,14 +1,221 @@
 import collections
+import contextlib
+import hashlib
+import os
+import threading
 from operator import attrgetter
 from django.conf import settings
 from django.contrib.staticfiles import utils
 from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils import timezone
 
-from .file_objects import FileObject
+from . import dependencies
+from .file_objects import FileObject, stat_fingerprint
 from .query import Q
 
 
+def _scandir(root, location=''):
+    # Like staticfiles' get_files(): files first, then recurse
+    # into subdirectories.
+    directories = []
+    for entry in os.scandir(os.path.join(root, location)):
+        name = os.path.join(location, entry.name)
+        if entry.is_dir():
+            directories.append(name)
+        else:
+            yield name, entry.stat()
+    for directory in directories:
+        yield from _scandir(root, directory)
+
+
+class Scan(list):
+    """
+    The objects found by scanning an FBO's tree, shared between every
+    FBO on that tree (see FBO._tree_key()) until the tree changes.
+    Indexes built over the results of those FBOs are kept on the scan,
+    so they're thrown away with it when the tree is rescanned.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.indexes = {}
+
+
+# The latest scan of each tree, keyed on FBO._tree_key(), with a
+# digest of the walk it was made from; see _shared_scan().
+_scans = {}
+# While a bake session is active, a snapshot of each tree, and the
+# walk it was made from; see bake_session().
+_snapshots = None
+_walks = None
+_session_depth = 0
+# Guards all of the above, since requests and bakes can be running
+# in several threads at once.
+_lock = threading.RLock()
+
+
+@receiver(setting_changed)
+def _forget_scans(**kwargs):
+    # Objects work out things like dates once, in terms of settings
+    # such as TIME_ZONE, so don't keep them when those change (which
+    # in practice means in tests).
+    with _lock:
+        _scans.clear()
+
+
+@contextlib.contextmanager
+def bake_session(fbos=()):
+    """
+    Within this block, every FBO on the same tree shares a single
+    snapshot of it, and so the indexes built over it. Each tree is
+    only scanned once, and everything sees the same version of it even
+    if files change meanwhile (including with DEBUG on).
+
+    Trees are scanned the first time they're needed, or up front for
+    those of `fbos`. Objects already loaded outside the session (for
+    instance by django_FBO.indexing.warm()) are reused if their files
+    haven't changed.
+
+    Sessions are process-wide, and don't nest: an inner one (or one in
+    another thread) just joins the outer one, and the session ends
+    when the last of them does. Worker processes can join the session
+    too; see export_session().
+    """
+
+    global _snapshots, _walks, _session_depth
+    with _lock:
+        if _snapshots is None:
+            _snapshots = {}
+            _walks = {}
+        _session_depth += 1
+    try:
+        for fbo in fbos:
+            _snapshot(fbo)
+        yield
+    finally:
+        with _lock:
+            _session_depth -= 1
+            if _session_depth == 0:
+                _snapshots = None
+                _walks = None
+
+
+def export_session():
+    """
+    Return what another process needs to join the current bake
+    session (see join_session()): the (name, stat) entries of the walk
+    behind each snapshot so far, keyed on FBO._tree_key(). Returns
+    None outside a session.
+    """
+
+    with _lock:
+        if _walks is None:
+            return None
+        return dict(_walks)
+
+
+def join_session(walks):
+    """
+    Join a bake session for the rest of this (worker) process, given
+    export_session() from the process running the session. Trees are
+    snapshotted from the same walks rather than walked again, so the
+    worker sees the same version of them, and each worker only scans
+    once however many batches it's given.
+
+    If we were forked from within the session, we already have it,
+    snapshots and all, so this does nothing.
+    """
+
+    global _snapshots, _walks, _session_depth
+    with _lock:
+        if _snapshots is None:
+            _snapshots = {}
+            _walks = dict(walks)
+            _session_depth += 1
+
+
+def _snapshot(fbo):
+    # Returns None outside a bake session.
+    key = fbo._tree_key()
+    with _lock:
+        if _snapshots is None:
+            return None
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            entries = _walks.get(key)
+            if entries is None:
+                entries = _walks[key] = list(fbo._walk())
+            shared = _scans.get(key)
+            snapshot = _snapshots[key] = _build_scan(
+                fbo,
+                entries,
+                None if shared is None else shared[1],
+            )
+        return snapshot
+
+
+def _shared_scan(fbo):
+    # Walking the tree costs a stat per file (which we get from the
+    # walk anyway for local storage), but no reads or parsing, so we
+    # can afford to check for changes each time we're asked and only
+    # scan again if there are any.
+    key = fbo._tree_key()
+    entries = list(fbo._walk())
+    digest = _digest_walk(entries)
+    with _lock:
+        shared = _scans.get(key)
+        if shared is not None and digest is not None and shared[0] == digest:
+            return shared[1]
+        scan = _build_scan(
+            fbo,
+            entries,
+            None if shared is None else shared[1],
+        )
+        _scans[key] = (digest, scan)
+        return scan
+
+
+def _digest_walk(entries):
+    # Without stat data (for remote storage) we can't tell if a file
+    # has changed, so there's no digest, and we always scan again.
+    digest = hashlib.blake2b(digest_size=16)
+    for name, stat in entries:
+        if stat is None:
+            return None
+        digest.update(
+            ('%s:%s\n' % (name, stat_fingerprint(stat))).encode(
+                'utf-8',
+                'surrogateescape',
+            ),
+        )
+    return digest.digest()
+
+
+def _build_scan(fbo, entries, previous=None):
+    # Make a Scan from a walk, reusing objects from previous where
+    # we can tell their files haven't changed, so they don't need
+    # parsing again.
+    if previous is None:
+        known = {}
+    else:
+        known = {obj.name: obj for obj in previous}
+    scan = Scan()
+    with dependencies.suppressed():
+        for name, stat in entries:
+            obj = known.get(name)
+            if (
+                obj is None or
+                stat is None or
+                obj._stat is None or
+                stat_fingerprint(obj._stat) != stat_fingerprint(stat)
+            ):
+                obj = fbo._make_object(name, stat)
+            scan.append(obj)
+    return scan
+
+
 OPTS = [
     'path',
     'metadata',
@@ -19,6 +226,7 @@ OPTS = [
     '_filters',
     '_order_by',
     '_slice',
+    '_subset',
     '_fetched',
 ]
 
@@ -35,6 +243,9 @@ class FBO:
     _filters = None
     _order_by = None
     _slice = None
+    # If set, a sequence of objects (from an index) known to include
+    # all our results, which we use instead of scanning.
+    _subset = None
 
     def __init__(self, **kwargs):
         self._fetched = None
@@ -244,25 +455,132 @@ class FBO:
             _count += 1
         return _count
 
+    def _tree_key(self):
+        # FBOs with the same key will build identical objects
+        # for the same file, so can share work done scanning.
+        if self.slug_suffices is None:
+            slug_suffices = None
+        else:
+            slug_suffices = tuple(self.slug_suffices)
+        return (
+            self.storage,
+            self.path,
+            self.model,
+            self.metadata,
+            slug_suffices,
+            self.slug_strip_index,
+        )
+
+    def _walk(self):
+        """
+        Yield (name, stat) for each file in our storage. For local
+        storage we get the stat data from the walk itself; otherwise
+        it's left as None, and each object will stat on demand.
+        """
+
+        if isinstance(self._storage, FileSystemStorage):
+            yield from _scandir(self._storage.location)
+        else:
+            for name in utils.get_files(self._storage):
+                yield name, None
+
+    def _make_object(self, name, stat=None):
+        return self.model(
+            self._storage,
+            self.metadata,
+            name,
+            self.slug_suffices,
+            self.slug_strip_index,
+            stat=stat,
+        )
+
     def _prefetch(self):
-        if self._fetched is None or settings.DEBUG:
-            self._fetched = []
-            for fname in utils.get_files(self._storage):
-                _file = self.model(
-                    self._storage,
-                    self.metadata,
-                    fname,
-                    self.slug_suffices,
-                    self.slug_strip_index,
+        snapshot = _snapshot(self)
+        if snapshot is not None:
+            # Everything on our tree shares its snapshot, and so
+            # filters as it evaluates.
+            self._fetched = snapshot
+        elif self._fetched is None or settings.DEBUG:
+            # Likewise for the latest scan of our tree, which we
+            # check is still current once, and then for each clone
+            # made from us after that, unless DEBUG is on, when we
+            # check every time.
+            self._fetched = _shared_scan(self)
+
+    def warm(self, jobs=None):
+        """
+        Scan our tree, parsing metadata across `jobs` worker processes,
+        for every FBO on it to share. See django_FBO.indexing.
+        """
+
+        from .indexing import warm
+        warm([self], jobs)
+
+    def get_index(self, name, build):
+        """
+        Return the index `name` over our results, calling build()
+        with the list of results to make it if we don't have one yet.
+
+        Indexes live on the scan, so every FBO on the tree with the
+        same filters, ordering and slice shares them (across requests,
+        too), and they're only built again once the tree changes.
+        """
+
+        if self._subset is not None:
+            # Not a view onto the scan, so nothing to share.
+            _objects = self._evaluate(self._subset)
+            dependencies.record_query(self, _objects)
+            with dependencies.suppressed():
+                return build(_objects)
+        self._prefetch()
+        scan = self._fetched
+        key = (
+            name,
+            tuple(str(_filter) for _filter in self._filters),
+            tuple(self._order_by),
+            self._slice,
+        )
+        if key not in scan.indexes:
+            _objects = self._evaluate(scan)
+            with dependencies.suppressed():
+                # We keep a digest of the results, so that baking can
+                # record that it depends on them without evaluating
+                # again. See django_FBO.dependencies.
+                scan.indexes[key] = (
+                    build(_objects),
+                    dependencies.digest_objects(_objects),
                 )
-                if self._check_filters(_file):
-                    self._fetched.append(_file)
+        index, digest = scan.indexes[key]
+        dependencies.record_query(self, digest=digest)
+        return index
 
     def __iter__(self):
-        self._prefetch()
+        if self._subset is not None:
+            _objects = self._evaluate(self._subset)
+        else:
+            self._prefetch()
+            _objects = self._evaluate(self._fetched)
+        dependencies.record_query(self, _objects)
+        return iter(_objects)
+
+    def _evaluate(self, _objects):
+        # Looking at objects to filter and order them doesn't mean
+        # we depend on them; see django_FBO.dependencies.
+        with dependencies.suppressed():
+            return self._filter_and_order(_objects)
+
+    def _filter_and_order(self, _objects):
+        # check filters here as well as so we can copy
+        # our cached fetched data around, to avoid hitting
+        # the filesystem so much
+        _filtered = []
+        for _file in _objects:
+            if self._check_filters(_file):
+                _filtered.append(_file)
+
         # apply order_by here because we may have prefetched on a
-        # previous copy of this
-        _objects = self._fetched
+        # previous copy of this (after filtering, since there's
+        # less to sort, and sorting is stable so it's the same)
         for _order_by in self._order_by:
             if _order_by[0] == '-':
                 _rev = True
@@ -270,18 +588,11 @@ class FBO:
             else:
                 _rev = False
                 _attr = _order_by
-            _objects = sorted(_objects, key=attrgetter(_attr), reverse=_rev)
+            _filtered = sorted(_filtered, key=attrgetter(_attr), reverse=_rev)
 
-        # check filters here as well as so we can copy
-        # our cached fetched data around, to avoid hitting
-        # the filesystem so much
-        _filtered = []
-        for _file in _objects:
-            if self._check_filters(_file):
-                _filtered.append(_file)
         if self._slice is not None:
             _filtered = _filtered.__getitem__(self._slice)
-        return iter(_filtered)
+        return _filtered
 
     def _check_filters(self, _file):
         for _filter in self._filters:
@@ -1,10 +1,18 @@
+import bisect
+import collections
+import datetime
+import hashlib
 import os.path
+from operator import attrgetter
 from django.conf import settings
 from django.conf.urls import url
 from django.contrib.syndication.views import Feed as _Feed
+from django.core.cache import caches
+from django.http import Http404, HttpResponse
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.feedgenerator import Atom1Feed
+from django.utils.translation import gettext as _
 from django.views.generic import (
     DetailView as _DetailView,
     ArchiveIndexView as _ArchiveIndexView,
@@ -14,8 +22,9 @@ from django.views.generic import (
     DateDetailView as _DateDetailView,
     ListView,
 )
-from markdown_deux import markdown
-from .. import FBO, FileObject, Q, Bakeable
+from django.views.generic.dates import timezone_today
+from .. import FBO, FBOPaginator, FileObject, Q, Bakeable, RenderCacheMixin
+from ..rendering import render_markdown
 
 
 def get_drafts_prefix():
@@ -76,31 +85,42 @@ class BlogPostFile(FileObject):
             # four or more /-separated sections in the slug.
             return slug
 
+    # Worked out on first use; see date.
+    _date = None
+
     @property
     def date(self):
-        # figure out the date from the name, else delegate
-        # to published
+        """
+        Midnight (in the default timezone if USE_TZ) on the day
+        given by the name, if it starts YEAR/MONTH/DAY/; otherwise
+        published.
+
+        It's the default ordering and what archives filter on, so
+        we only work it out once per object.
+        """
+
+        if self._date is None:
+            self._date = self._parse_date()
+        return self._date
+
+    def _parse_date(self):
         try:
             year, month, day, _ = self.name.split('/', 3)
-            return timezone.now().replace(
-                year=int(year),
-                month=int(month),
-                day=int(day),
-                hour=0,
-                minute=0,
-                second=0,
-                microsecond=0,
-            )
+            date = datetime.datetime(int(year), int(month), int(day))
         except ValueError:
-            # Not enough /-separated sections to split.
+            # Not enough /-separated sections to split, or they
+            # aren't a valid date.
             return self.published
+        if settings.USE_TZ:
+            date = timezone.make_aware(date, timezone.get_default_timezone())
+        return date
 
     @property
     def published(self):
-        if 'published' in self.metadata:
-            return self.metadata['published']
-        else:
-            return self.storage.get_created_time(self.name)
+        published = self.metadata.get('published')
+        if published is None:
+            return self.file_created
+        return published
 
 
 class BlogPost(FBO):
@@ -120,26 +140,92 @@ class BlogPost(FBO):
             Q(name__startswith=get_drafts_prefix()),
         )
 
+    def _neighbours(self):
+        # Published posts in order, and each one's position, so
+        # finding neighbours doesn't mean iterating everything. The
+        # index lives on the scan of our tree, so it's shared by every
+        # request until a post changes.
+        return self.exclude_drafts().get_index(
+            'neighbours',
+            lambda posts: (
+                posts,
+                {post.path: position for position, post in enumerate(posts)},
+            ),
+        )
+
     def find_next(self, obj):
-        _iter = iter(self.exclude_drafts())
-        try:
-            for candidate in _iter:
-                if candidate == obj:
-                    return next(_iter)
-        except StopIteration:
+        posts, positions = self._neighbours()
+        position = positions.get(obj.path)
+        if position is None or position + 1 >= len(posts):
             return None
+        return posts[position + 1]
 
     def find_previous(self, obj):
-        _iter = iter(self.exclude_drafts())
-        previous = None
-        try:
-            for candidate in _iter:
-                if candidate == obj:
-                    return previous
-                else:
-                    previous = candidate
-        except StopIteration:
+        posts, positions = self._neighbours()
+        position = positions.get(obj.path)
+        if position is None or position == 0:
             return None
+        return posts[position - 1]
+
+
+def get_date_buckets(queryset, date_field):
+    """
+    Group the objects in queryset by the year, month and day of
+    their date_field, in one pass. Returns a dict mapping 'year',
+    'month' and 'day' to an ordered dict of date -> list of objects,
+    in date order, each list in queryset order.
+
+    Dates are taken in the current timezone, as the archive views'
+    lookups are. The result is kept as an index on queryset's scan
+    (see FBO.get_index()), so archives of every period share it, across
+    requests, until a post changes.
+    """
+
+    def build(objects):
+        buckets = {
+            'year': collections.OrderedDict(),
+            'month': collections.OrderedDict(),
+            'day': collections.OrderedDict(),
+        }
+        dated = []
+        for obj in objects:
+            dt = getattr(obj, date_field)
+            if isinstance(dt, datetime.datetime) and timezone.is_aware(dt):
+                dt = timezone.localtime(dt)
+            dated.append((dt.year, dt.month, dt.day, obj))
+        # Stable, so each bucket stays in queryset order.
+        dated.sort(key=lambda item: item[:3])
+        for year, month, day, obj in dated:
+            buckets['year'].setdefault(
+                datetime.date(year, 1, 1), [],
+            ).append(obj)
+            buckets['month'].setdefault(
+                datetime.date(year, month, 1), [],
+            ).append(obj)
+            buckets['day'].setdefault(
+                datetime.date(year, month, day), [],
+            ).append(obj)
+        return buckets
+
+    return queryset.get_index(
+        ('date-buckets', date_field, timezone.get_current_timezone_name()),
+        build,
+    )
+
+
+def get_date_index(queryset, date_field):
+    """
+    Return (dates, objects): the objects in queryset sorted by their
+    date_field, and those dates, for bisecting. Kept as an index on
+    queryset's scan (see FBO.get_index()), so it's only built again
+    once a post changes.
+    """
+
+    def build(objects):
+        objects = sorted(objects, key=attrgetter(date_field))
+        return [getattr(obj, date_field) for obj in objects], objects
+
+    return queryset.get_index(('date-index', date_field), build)
 
 
 class BakeableBlogMixin(Bakeable):
@@ -148,11 +234,46 @@ class BakeableBlogMixin(Bakeable):
     date_field = 'date'
     uses_datetime_field = True
     paginate_by = 10
+    paginator_class = FBOPaginator
     make_object_list = True
 
     def get_url_name(self):
         return self.url_name
 
+    def get_dated_queryset(self, **lookup):
+        """
+        As the CBV version, but rather than filtering every post, use
+        a date index to narrow things down to those in range first.
+        """
+
+        date_field = self.get_date_field()
+        if not self.get_allow_future():
+            now = timezone.now() if self.uses_datetime_field else timezone_today()
+            lookup['%s__lte' % date_field] = now
+        qs = self.get_queryset()
+        dates, objects = get_date_index(qs, date_field)
+        first, last = 0, len(dates)
+        for key, value in lookup.items():
+            if key == '%s__gte' % date_field:
+                first = max(first, bisect.bisect_left(dates, value))
+            elif key == '%s__gt' % date_field:
+                first = max(first, bisect.bisect_right(dates, value))
+            elif key == '%s__lte' % date_field:
+                last = min(last, bisect.bisect_right(dates, value))
+            elif key == '%s__lt' % date_field:
+                last = min(last, bisect.bisect_left(dates, value))
+            else:
+                return super().get_dated_queryset(**lookup)
+        # We still filter, which costs little now, so that the
+        # queryset means what it says if you clone it.
+        qs = qs.filter(**lookup).clone(_subset=tuple(objects[first:last]))
+
+        if not self.get_allow_empty() and first >= last:
+            raise Http404(_("No %(verbose_name_plural)s available") % {
+                'verbose_name_plural': qs.model._meta.verbose_name_plural,
+            })
+        return qs
+
     def _paginate_for_baking(self, qs, date):
         page_size = self.get_paginate_by(qs)
         if page_size:
@@ -207,26 +328,26 @@ class BakeableBlogDateMixin(BakeableBlogMixin):
         # Marvel at how much duplication there is between this and the
         # CBV date system! All the fun of millions of classes, without
         # the extension hooks you actually need.
+        #
+        # Rather than filtering the queryset once per date, we group
+        # the posts by date in a single pass and paginate the groups.
+        date_field = self.get_date_field()
+        buckets = get_date_buckets(self.get_queryset(), date_field)
         kind = self.get_date_list_period_for_baking()
-
-        for date in self.get_queryset().datetimes(
-            field_name=self.get_date_field(),
-            kind=kind,
-            ordering='ASC',
-        ):
-            # For each date, paginate!
-            date_field = self.get_date_field()
-            since = self._make_date_lookup_arg(date)
-            # _get_next_year, _get_next_month, _get_next_day
-            until = self._make_date_lookup_arg(
-                getattr(self, '_get_next_' + kind)(date)
-            )
-            lookup_kwargs = {
-                '%s__gte' % date_field: since,
-                '%s__lt' % date_field: until,
-            }
-            qs = self.get_dated_queryset(**lookup_kwargs)
-            for path in self._paginate_for_baking(qs, date):
+        if self.get_allow_future():
+            now = None
+        else:
+            # As get_dated_queryset() would.
+            now = timezone.now()
+        for date, posts in buckets[kind].items():
+            if now is not None:
+                posts = [
+                    post for post in posts
+                    if getattr(post, date_field) <= now
+                ]
+                if not posts:
+                    continue
+            for path in self._paginate_for_baking(posts, date):
                 yield path
 
 
@@ -260,17 +381,43 @@ class DayArchiveView(BakeableBlogDateMixin, _DayArchiveView):
         }
 
 
-class DateDetailView(Bakeable, _DateDetailView):
+class DateDetailView(RenderCacheMixin, Bakeable, _DateDetailView):
     template_name = 'blog/post.html'
     queryset = BlogPost()
     date_field = 'date'
     uses_datetime_field = True
     month_format = '%m'
 
+    def get_queryset(self):
+        # Check the tree is unchanged once per request, rather than
+        # for finding the post and each of its neighbours. The scan
+        # (and the neighbours index on it) is shared with other
+        # requests; we just don't keep it on self.queryset, which
+        # would never look again.
+        if not hasattr(self, '_scanned_queryset'):
+            queryset = super().get_queryset()
+            queryset._prefetch()
+            self._scanned_queryset = queryset
+        return self._scanned_queryset.all()
+
+    def get_neighbours(self):
+        if not hasattr(self, '_neighbours'):
+            queryset = self.get_queryset()
+            self._neighbours = (
+                queryset.find_next(self.object),
+                queryset.find_previous(self.object),
+            )
+        return self._neighbours
+
+    def get_conditional_objects(self):
+        # The links to next and previous posts are part of the page.
+        return [self.object] + [
+            obj for obj in self.get_neighbours() if obj is not None
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['next_object'] = self.queryset.find_next(self.object)
-        context['previous_object'] = self.queryset.find_previous(self.object)
+        context['next_object'], context['previous_object'] = self.get_neighbours()
         return context
 
     def get_paths(self):
@@ -287,12 +434,13 @@ class DraftsList(ListView):
         Q(name__startswith=get_drafts_prefix())
     )
     paginate_by = None
+    paginator_class = FBOPaginator
 
     def get_template_names(self):
         return ['blog/drafts_index.html', 'blog/index.html']
 
 
-class DraftDetailView(Bakeable, _DetailView):
+class DraftDetailView(RenderCacheMixin, Bakeable, _DetailView):
     template_name = 'blog/draft.html'
     queryset = BlogPost().filter(
         name__startswith=get_drafts_prefix(),
@@ -340,7 +488,7 @@ class Feed(_Feed):
         return item.date
 
     def item_description(self, item):
-        return markdown(item.content)
+        return render_markdown(item.content)
 
     def item_extra_kwargs(self, item):
         extra = {}
@@ -370,6 +518,14 @@ class FeedMixin(object):
     # Feed class itself
     feed_class = Feed
 
+    # Cache alias for rendered feeds, defaulting to
+    # settings.FBO_FEED_CACHE; caching is off unless one of those is
+    # set. Set to False to disable caching for this feed regardless.
+    feed_cache = None
+    # How long cached feeds last. Entries are never stale, but a new
+    # one is made whenever a post changes, so don't keep them forever.
+    feed_cache_timeout = 24 * 60 * 60
+
     def get_title(self):
         return self.feed_title
 
@@ -382,15 +538,75 @@ class FeedMixin(object):
     def get_copyright(self):
         return self.feed_copyright
 
+    def get_feed_cache(self):
+        alias = self.feed_cache
+        if alias is None:
+            alias = getattr(settings, 'FBO_FEED_CACHE', None)
+        if not alias:
+            return None
+        return caches[alias]
+
+    def get_feed_cache_key(self, items):
+        """
+        The feed is entirely determined by its items, its settings
+        and where it's being served from, so key on all of those.
+        Feeds ignore the query string, and so do we.
+        Item files are identified by name and fingerprint (mtime and
+        size), so editing, adding or removing posts changes the key.
+        """
+
+        key = hashlib.blake2b(digest_size=20)
+        for part in [
+            type(self).__module__,
+            type(self).__qualname__,
+            self.feed_class.__module__,
+            self.feed_class.__qualname__,
+            self.get_title(),
+            self.get_subtitle(),
+            self.get_link(),
+            self.get_copyright(),
+            self.paginate_by,
+            self.request.scheme,
+            self.request.get_host(),
+            self.request.path,
+        ] + [
+            '%s:%s' % (item.name, item.fingerprint) for item in items
+        ]:
+            key.update(('%s\n' % part).encode('utf-8'))
+        return 'django_FBO.feed.%s' % key.hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        # We don't need the date list and so on that ListView and
+        # friends would compute.
+        return self.render_to_response({})
+
     def render_to_response(self, context):
+        items = list(self.get_queryset()[:self.paginate_by])
+        cache = self.get_feed_cache()
+        if getattr(self.request, 'fbo_baking', False):
+            cache = None
+        if cache is not None:
+            cache_key = self.get_feed_cache_key(items)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
         feedview = self.feed_class(self.paginate_by)
         feedview.title = self.get_title()
         feedview.subtitle = self.get_subtitle()
         feedview.link = self.get_link()
-        feedview.queryset = self.get_queryset()
+        feedview.queryset = items
         feedview.feed_copyright = self.get_copyright()
         feedview.item_copyright = self.get_copyright()
-        return feedview(self.request, *self.args, **self.kwargs)
+        response = feedview(self.request, *self.args, **self.kwargs)
+        if cache is not None and response.status_code == 200:
+            cache.set(
+                cache_key,
+                (response.content, response['Content-Type']),
+                self.feed_cache_timeout,
+            )
+        return response
 
 
 class BlogFeed(FeedMixin, ArchiveIndexView):
@@ -18,16 +18,40 @@ and set the following in settings:
 FBO_INTERSPERSED_EXTS = [ 'jpg', 'png', 'pdf' ]
 
 (The default list is empty.)
+
+Binary objects are streamed from disk rather than loaded into memory.
+If your front-end server can do the I/O itself, set:
+
+FBO_BINARY_SENDFILE = 'x-sendfile'
+
+for Apache's mod_xsendfile (or lighttpd), or for nginx:
+
+FBO_BINARY_SENDFILE = 'x-accel-redirect'
+FBO_BINARY_ACCEL_REDIRECT_PREFIX = '/_fbo/'
+
+where /_fbo/ is an internal location aliased to the FBO's path.
+
+When we're streaming ourselves, byte range requests are supported
+(including multiple ranges, sent as multipart/byteranges).
+
+Baking copies binary objects rather than rendering them; see
+Bakeable.get_bake_source().
 """
 
 from django.conf import settings
 from django.conf.urls import url
-from django.http import HttpResponse
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.crypto import get_random_string
+from django.utils.http import parse_http_date_safe
 from functools import reduce
+from urllib.parse import quote
 import mimetypes
 import os.path
+import re
 
 from .. import Q
+from ..dependencies import record_source
 from .pages import PageView
 from .binary import BinaryFBO, BinaryView
 
@@ -36,9 +60,163 @@ class InterspersedBinaryFBO(BinaryFBO):
     path = os.path.join(settings.BASE_DIR, 'pages')
 
 
+class BinaryFileResponse(FileResponse):
+    """
+    A FileResponse that takes its Content-Length from the FileObject's
+    stat data, so it matches the rest of the headers we send for it.
+    Everything else (Content-Type, and Content-Disposition for
+    as_attachment and filename) is as for FileResponse.
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self, fileobject, *args, **kwargs):
+        self.fileobject = fileobject
+        super().__init__(
+            fileobject.storage.open(fileobject.name, 'rb'),
+            *args,
+            **kwargs
+        )
+
+    def set_headers(self, filelike):
+        super().set_headers(filelike)
+        self['Content-Length'] = self.fileobject.file_size
+
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range_header(header, size):
+    """
+    Parse an HTTP Range header for a resource of `size` bytes.
+
+    Returns a list of (first, last) byte positions (inclusive, as in
+    Content-Range), which is empty if none of the ranges can be
+    satisfied; or None if we don't understand the header, in which
+    case it should be ignored (RFC 7233 section 3.1).
+    """
+
+    unit, _, ranges_spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in ranges_spec.split(','):
+        match = RANGE_RE.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            # Suffix range: the final `last` bytes.
+            length = int(last)
+            if length == 0 or size == 0:
+                # Nothing to send, even of an empty file.
+                continue
+            first, last = max(0, size - length), size - 1
+        else:
+            first = int(first)
+            if last == '':
+                last = size - 1
+            else:
+                last = int(last)
+                if last < first:
+                    return None
+                last = min(last, size - 1)
+            if first >= size:
+                continue
+        ranges.append((first, last))
+    return ranges
+
+
+def _read_ranges(fileobject, parts, block_size):
+    # parts is a sequence of (prefix, first, last), with prefix being
+    # bytes to send before that range; anything else in parts is sent
+    # as-is. We seek rather than reading what we don't need.
+    with fileobject.storage.open(fileobject.name, 'rb') as _file:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            prefix, first, last = part
+            if prefix:
+                yield prefix
+            _file.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = _file.read(min(block_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+class BinaryRangeResponse(StreamingHttpResponse):
+    """
+    A 206 Partial Content response for one or more byte ranges of a
+    FileObject.
+    """
+
+    block_size = BinaryFileResponse.block_size
+
+    def __init__(self, fileobject, ranges, content_type):
+        size = fileobject.file_size
+        content_range = None
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            parts = [(b'', first, last)]
+            length = last - first + 1
+            content_range = 'bytes %d-%d/%d' % (first, last, size)
+        else:
+            boundary = get_random_string(32)
+            parts = []
+            for first, last in ranges:
+                parts.append((
+                    (
+                        '\r\n--%s\r\nContent-Type: %s\r\n'
+                        'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                            boundary,
+                            content_type,
+                            first,
+                            last,
+                            size,
+                        )
+                    ).encode('ascii'),
+                    first,
+                    last,
+                ))
+            parts.append(('\r\n--%s--\r\n' % boundary).encode('ascii'))
+            length = sum(
+                len(part) if isinstance(part, bytes)
+                else len(part[0]) + part[2] - part[1] + 1
+                for part in parts
+            )
+            content_type = 'multipart/byteranges; boundary=%s' % boundary
+
+        super().__init__(
+            _read_ranges(fileobject, parts, self.block_size),
+            status=206,
+            content_type=content_type,
+        )
+        self['Content-Length'] = length
+        if content_range is not None:
+            self['Content-Range'] = content_range
+
+
 class InterspersedBinaryView(BinaryView):
     queryset = InterspersedBinaryFBO()
     ext = None
+    # None (stream it ourselves), 'x-sendfile' or 'x-accel-redirect';
+    # defaults to settings.FBO_BINARY_SENDFILE.
+    sendfile = None
+    # For X-Accel-Redirect, the internal location corresponding to
+    # the FBO's path; defaults to
+    # settings.FBO_BINARY_ACCEL_REDIRECT_PREFIX.
+    accel_redirect_prefix = None
+    # More ranges than this in one request and we send everything.
+    max_ranges = 16
+    # We stream, so there's nothing to cache.
+    render_cache = False
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -57,14 +235,88 @@ class InterspersedBinaryView(BinaryView):
         )
         if mime_type is None:
             mime_type = 'application/octet-stream'
-        resp = HttpResponse(
-            content=self.object.content,
-            content_type=mime_type,
-        )
+        sendfile = self.get_sendfile()
+        # When baking we need the content itself, of course.
+        if sendfile is None or getattr(request, 'fbo_baking', False):
+            resp = self.get_file_response(request, mime_type)
+        elif sendfile == 'x-sendfile':
+            resp = HttpResponse(content_type=mime_type)
+            resp['X-Sendfile'] = self.object.path
+        elif sendfile == 'x-accel-redirect':
+            resp = HttpResponse(content_type=mime_type)
+            resp['X-Accel-Redirect'] = (
+                self.get_accel_redirect_prefix() + quote(self.object.name)
+            )
+        else:
+            raise ImproperlyConfigured(
+                "Unknown sendfile mode '%s'." % sendfile,
+            )
         if encoding is not None:
             resp['Content-Encoding'] = encoding
         return resp
 
+    def get_bake_source(self):
+        # Baking just copies the file.
+        try:
+            self.object = self.get_object()
+        except Http404:
+            return None
+        record_source(self.object)
+        return self.object.path
+
+    def get_file_response(self, request, mime_type):
+        ranges = None
+        if 'HTTP_RANGE' in request.META and self.if_range_matches(request):
+            ranges = parse_range_header(
+                request.META['HTTP_RANGE'],
+                self.object.file_size,
+            )
+            if ranges is not None and len(ranges) > self.max_ranges:
+                ranges = None
+        if ranges is None:
+            resp = BinaryFileResponse(
+                self.object,
+                content_type=mime_type,
+            )
+        elif not ranges:
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = 'bytes */%d' % self.object.file_size
+        else:
+            resp = BinaryRangeResponse(self.object, ranges, mime_type)
+        resp['Accept-Ranges'] = 'bytes'
+        return resp
+
+    def if_range_matches(self, request):
+        """
+        Should we honour the Range header? Only if there's no
+        If-Range, or if it matches what we have now.
+        """
+
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None:
+            return True
+        if if_range.startswith('"'):
+            return if_range == self.get_etag()
+        if_range_date = parse_http_date_safe(if_range)
+        return if_range_date == self.get_last_modified()
+
+    def get_sendfile(self):
+        if self.sendfile is not None:
+            return self.sendfile
+        return getattr(settings, 'FBO_BINARY_SENDFILE', None)
+
+    def get_accel_redirect_prefix(self):
+        prefix = self.accel_redirect_prefix
+        if prefix is None:
+            prefix = getattr(settings, 'FBO_BINARY_ACCEL_REDIRECT_PREFIX', None)
+        if prefix is None:
+            raise ImproperlyConfigured(
+                "X-Accel-Redirect needs FBO_BINARY_ACCEL_REDIRECT_PREFIX.",
+            )
+        if not prefix.endswith('/'):
+            prefix += '/'
+        return prefix
+
 
 class InterspersedPageView(PageView):
     pass
@@ -102,12 +354,13 @@ def get_interspersed_urls(exts, binaryview_kwargs=None, pageview_kwargs=None):
         pageview_kwargs = {}
     if 'queryset' not in pageview_kwargs:
         pageview_kwargs['queryset'] = InterspersedPageView.queryset
-    pageview_kwargs['queryset'] = pageview_kwargs['queryset'].exclude(
-        reduce(
-            lambda x, y: x | y,
-            pageview_excludes,
+    if pageview_excludes:
+        pageview_kwargs['queryset'] = pageview_kwargs['queryset'].exclude(
+            reduce(
+                lambda x, y: x | y,
+                pageview_excludes,
+            )
         )
-    )
     urls.append(
         url(
             r'^(?P<slug>.*)$',
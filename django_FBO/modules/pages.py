@@ -16,7 +16,7 @@ from django.conf import settings
 from django.urls import reverse
 from django.views.generic import DetailView
 
-from .. import FileObject, FBO, Q, Bakeable
+from .. import FileObject, FBO, Q, Bakeable, RenderCacheMixin
 
 
 class PageFile(FileObject):
@@ -41,7 +41,7 @@ class Page(FBO):
     slug_strip_index = True
 
 
-class PageView(Bakeable, DetailView):
+class PageView(RenderCacheMixin, Bakeable, DetailView):
     template_name = 'page.html'
     queryset = Page()
     slug = None
@@ -0,0 +1,102 @@
+"""
+Pagination for FBO querysets.
+
+Django's Paginator counts its object list and then slices it once per
+page, which for an FBO means filtering and ordering everything each
+time. FBOPaginator evaluates the queryset once up front, and serves
+the count and every page from that.
+
+It can also page by cursor rather than by number: page_after(name)
+gives the page following the object called name, which is cheap
+however deep into the results it is and stays put if objects are
+added before it.
+"""
+
+from django.core.paginator import EmptyPage, InvalidPage, Page, Paginator
+
+from .manager import FBO
+
+
+class FBOPaginator(Paginator):
+
+    def __init__(self, object_list, *args, **kwargs):
+        if isinstance(object_list, FBO):
+            # list() would count first, evaluating everything twice.
+            object_list = list(iter(object_list))
+        super().__init__(object_list, *args, **kwargs)
+        self._positions = None
+
+    def position(self, name):
+        """Return the index of the object called name in our results."""
+
+        if self._positions is None:
+            self._positions = {
+                obj.name: position
+                for position, obj in enumerate(self.object_list)
+            }
+        try:
+            return self._positions[name]
+        except KeyError:
+            raise InvalidPage("No object called '%s'." % name)
+
+    def page_after(self, name=None):
+        """
+        Return a CursorPage of the objects following the one called
+        name (or the first page, if name is None).
+        """
+
+        if name is None:
+            bottom = 0
+        else:
+            bottom = self.position(name) + 1
+            if bottom >= self.count:
+                raise EmptyPage("No objects after '%s'." % name)
+        return CursorPage(
+            self.object_list[bottom:bottom + self.per_page],
+            bottom,
+            self,
+        )
+
+
+class CursorPage(Page):
+    """
+    A page starting with the object at index bottom, which needn't be
+    on a page boundary. Go on to the next one using next_cursor (the
+    name of our last object, if there's anything after it) rather than
+    by number. Our number is how many pages of objects there are up to
+    and including us, counting any part page before us as one.
+    """
+
+    def __init__(self, object_list, bottom, paginator):
+        self.bottom = bottom
+        super().__init__(
+            object_list,
+            -(-bottom // paginator.per_page) + 1,
+            paginator,
+        )
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.object_list[-1].name
+
+    def has_next(self):
+        return self.bottom + len(self) < self.paginator.count
+
+    def has_previous(self):
+        return self.bottom > 0
+
+    def next_page_number(self):
+        raise InvalidPage("Use next_cursor to page on from a cursor.")
+
+    def previous_page_number(self):
+        raise InvalidPage("Cursor pages can't be paged back by number.")
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return self.bottom + 1
+
+    def end_index(self):
+        return self.bottom + len(self)
@@ -0,0 +1,44 @@
+"""Process pool support, shared by bulk indexing and baking."""
+
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.apps import apps
+
+from .manager import join_session
+
+
+def _setup_worker(session=None):
+    # Under the fork start method Django is already set up in the
+    # worker; under spawn (the default on macOS and Windows) we have
+    # to do it ourselves, relying on DJANGO_SETTINGS_MODULE having
+    # been inherited from the parent.
+    if not apps.ready:
+        django.setup()
+    if session is not None:
+        join_session(session)
+
+
+def get_executor(jobs=None, session=None):
+    """
+    Return a ProcessPoolExecutor with `jobs` workers (defaults to
+    the number of CPUs), each of which has Django set up once.
+
+    If session is from django_FBO.manager.export_session(), each
+    worker joins that bake session for as long as it runs, whichever
+    start method is in use.
+    """
+
+    return ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_setup_worker,
+        initargs=(session,),
+    )
+
+
+def shard(items, shards):
+    """Split the list `items` into at most `shards` contiguous lists."""
+
+    size = max(1, -(-len(items) // max(1, shards)))
+    return [
+        items[i:i+size] for i in range(0, len(items), size)
+    ]
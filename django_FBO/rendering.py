@@ -0,0 +1,59 @@
+"""
+Cached markdown rendering.
+
+Converting markdown is often the most expensive part of serving or
+baking an FBO site, and the same posts get rendered over and over (on
+their own pages, in indexes, in the feed). render_markdown() keeps the
+result in Django's cache framework, keyed on a hash of the text and
+the markdown_deux style, so rendering an unchanged post costs a
+lookup.
+
+settings.FBO_MARKDOWN_CACHE names the cache alias to use (defaulting
+to 'default'; set it to None to turn caching off). Point it at a
+FileBasedCache if you want renders to survive between bakes.
+
+In templates:
+
+{% load fbo_markdown %}
+{{ object.content|cached_markdown }}
+{{ object.content|cached_markdown:"mystyle" }}
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+import hashlib
+
+
+def get_markdown_cache():
+    alias = getattr(settings, 'FBO_MARKDOWN_CACHE', 'default')
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def render_markdown(text, style='default'):
+    """Render `text` using markdown_deux, caching the result."""
+
+    # Imported here so sites without markdown_deux can still load
+    # our template tags.
+    from markdown_deux import get_style, markdown
+
+    if not text:
+        return ''
+    cache = get_markdown_cache()
+    if cache is None:
+        return mark_safe(markdown(text, style))
+
+    digest = hashlib.blake2b(digest_size=20)
+    # The style's configuration, not just its name, affects output.
+    digest.update(repr(get_style(style)).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    key = 'django_FBO.markdown.%s' % digest.hexdigest()
+
+    html = cache.get(key)
+    if html is None:
+        html = str(markdown(text, style))
+        cache.set(key, html, None)
+    return mark_safe(html)
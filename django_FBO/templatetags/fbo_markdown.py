@@ -0,0 +1,16 @@
+from django import template
+
+from ..rendering import render_markdown
+
+
+register = template.Library()
+
+
+@register.filter(is_safe=True)
+def cached_markdown(value, style='default'):
+    """
+    Like markdown_deux's markdown filter, but cached; see
+    django_FBO.rendering.
+    """
+
+    return render_markdown(value, style)
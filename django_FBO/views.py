@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.template.loader import select_template
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+import hashlib
+import os
+
+
+class ConditionalResponseMixin:
+    """
+    Mixin for FBO detail views that adds ETag and Last-Modified
+    headers based on the files behind the response, and short-circuits
+    to 304 Not Modified (or 412 Precondition Failed) before anything
+    is rendered or read.
+
+    Put this before the view class in your bases. By default it's only
+    the object's own file that matters; override
+    get_conditional_objects() if other objects contribute. Note that
+    templates don't, so editing those on a live site won't invalidate
+    clients' caches.
+    """
+
+    def get_object(self, queryset=None):
+        # We look the object up in dispatch(), so don't do it again
+        # when the view itself asks.
+        if queryset is None and getattr(self, 'object', None) is not None:
+            return self.object
+        return super().get_object(queryset)
+
+    def get_conditional_objects(self):
+        return [self.object]
+
+    def get_etag(self):
+        objects = self.get_conditional_objects()
+        if len(objects) == 1:
+            return '"%s"' % objects[0].fingerprint
+        fingerprints = hashlib.blake2b(digest_size=16)
+        for obj in objects:
+            fingerprints.update(
+                ('%s:%s\n' % (obj.name, obj.fingerprint)).encode('utf-8'),
+            )
+        return '"%s"' % fingerprints.hexdigest()
+
+    def get_last_modified(self):
+        return max(
+            int(obj.file_modified.timestamp())
+            for obj in self.get_conditional_objects()
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        self.object = self.get_object()
+        etag = self.get_etag()
+        last_modified = self.get_last_modified()
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        if response is None:
+            response = self.dispatch_unconditional(request, *args, **kwargs)
+        # A 304 has to carry the validators a 200 would have (RFC 7232
+        # section 4.1), and get_conditional_response() doesn't add them.
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response.setdefault('ETag', etag)
+            response.setdefault('Last-Modified', http_date(last_modified))
+        return response
+
+    def dispatch_unconditional(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class RenderCacheMixin(ConditionalResponseMixin):
+    """
+    Opt-in caching of rendered responses for FBO detail views, in
+    Django's cache framework. Enable it with settings.FBO_RENDER_CACHE
+    (or the view's render_cache), naming the cache alias to use; set
+    render_cache to False to disable it for a view regardless.
+
+    Entries are keyed on the fingerprints of the files behind the
+    response (see ConditionalResponseMixin) and the template being
+    used, so they're never stale; when a rescan picks up a changed
+    file, we just look under a new key. Entries for old versions
+    expire after render_cache_timeout.
+    Templates that yours extends or includes aren't part of the key,
+    so clear the cache if you change those.
+
+    Only responses that are the same for everyone asking for that URL
+    are stored: not those with a query string (so they can't fill the
+    cache with copies of the same page), or that set cookies, are
+    private or uncacheable by Cache-Control, have a Vary header, or
+    used the session or a CSRF token. Headers are cached along with
+    the content.
+    """
+
+    render_cache = None
+    # How long cached responses last. Like the feed cache, entries
+    # are never stale, but don't keep ones for old versions forever.
+    render_cache_timeout = 24 * 60 * 60
+
+    def get_render_cache(self):
+        alias = self.render_cache
+        if alias is None:
+            alias = getattr(settings, 'FBO_RENDER_CACHE', None)
+        if not alias:
+            return None
+        return caches[alias]
+
+    def get_render_cache_key(self, request):
+        key = hashlib.blake2b(digest_size=20)
+
+        def _add(*parts):
+            key.update(('\0'.join(str(p) for p in parts) + '\n').encode('utf-8'))
+
+        _add(type(self).__module__, type(self).__qualname__)
+        _add(request.scheme, request.get_host(), request.get_full_path())
+        for obj in self.get_conditional_objects():
+            _add(obj.name, obj.fingerprint)
+        template = select_template(self.get_template_names())
+        origin = getattr(getattr(template, 'origin', None), 'name', None)
+        try:
+            mtime = os.stat(origin).st_mtime_ns
+        except (OSError, TypeError, ValueError):
+            mtime = None
+        _add(origin, mtime)
+        return 'django_FBO.render.%s' % key.hexdigest()
+
+    def dispatch_unconditional(self, request, *args, **kwargs):
+        cache = self.get_render_cache()
+        if (
+            cache is None or
+            request.META.get('QUERY_STRING') or
+            getattr(request, 'fbo_baking', False)
+        ):
+            return super().dispatch_unconditional(request, *args, **kwargs)
+
+        cache_key = self.get_render_cache_key(request)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+
+        response = super().dispatch_unconditional(request, *args, **kwargs)
+
+        def _store(response):
+            if _is_shared(request, response):
+                cache.set(
+                    cache_key,
+                    (response.content, list(response.items())),
+                    self.render_cache_timeout,
+                )
+
+        if isinstance(response, SimpleTemplateResponse):
+            if response.is_rendered:
+                _store(response)
+            else:
+                response.add_post_render_callback(_store)
+        else:
+            _store(response)
+        return response
+
+
+def _is_shared(request, response):
+    # Can response be given to anyone else asking for the same URL?
+    # Our cache key doesn't cover anything else about the request.
+    if response.status_code != 200 or response.streaming:
+        return False
+    if response.cookies or response.has_header('Vary'):
+        return False
+    cache_control = {
+        directive.split('=', 1)[0].strip().lower()
+        for directive in response.get('Cache-Control', '').split(',')
+    }
+    if cache_control & {'private', 'no-store', 'no-cache'}:
+        return False
+    # Middleware adds cookies and Vary: Cookie for these on the way out,
+    # after we've seen the response.
+    session = getattr(request, 'session', None)
+    if getattr(session, 'accessed', False):
+        return False
+    return not request.META.get('CSRF_COOKIE_USED', False)
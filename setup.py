@@ -12,6 +12,7 @@ setup(
         'django_FBO.modules',
         'django_FBO.management',
         'django_FBO.management.commands',
+        'django_FBO.templatetags',
     ],
     package_data={
         'django_FBO': [
@@ -1,10 +1,17 @@
 from django.conf.urls import include, url
 from django.contrib.staticfiles import utils
 from django.core.files.storage import FileSystemStorage
-from django.test import TestCase, override_settings
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+import datetime
+import os.path
+import shutil
 import tempfile
+from unittest import mock
 
 from django_FBO import bake
+from django_FBO.baking import plan_bake
 from django_FBO.modules import blog
 
 
@@ -38,6 +45,71 @@ class TestBlog(TestCase):
         self.assertEqual(qs[13], qs.find_previous(qs[14]))
         self.assertEqual(None, qs.find_next(qs[14]))
 
+    def test_date(self):
+        """Are dates from names midnight in the default timezone?"""
+
+        post = blog.BlogPost().get(name='2016/05/21/single-post')
+        self.assertEqual(
+            timezone.make_aware(datetime.datetime(2016, 5, 21)),
+            post.date,
+        )
+        # Worked out once.
+        self.assertIs(post.date, post.date)
+
+        with override_settings(TIME_ZONE='Europe/London'):
+            post = blog.BlogPost().get(name='2016/05/21/single-post')
+            self.assertEqual(
+                datetime.datetime(2016, 5, 20, 23, 0, tzinfo=timezone.utc),
+                post.date,
+            )
+
+    def test_date_buckets(self):
+        """Are posts grouped by year, month and day in one go?"""
+
+        qs = blog.BlogPost().exclude_drafts()
+        buckets = blog.get_date_buckets(qs, 'date')
+        self.assertEqual(
+            [datetime.date(2016, 1, 1)],
+            list(buckets['year'].keys()),
+        )
+        self.assertEqual(15, len(buckets['year'][datetime.date(2016, 1, 1)]))
+        self.assertEqual(
+            [
+                datetime.date(2016, 5, 1),
+                datetime.date(2016, 6, 1),
+                datetime.date(2016, 7, 1),
+            ],
+            list(buckets['month'].keys()),
+        )
+        self.assertEqual(
+            list(qs.filter(name__startswith='2016/06/21/')),
+            buckets['day'][datetime.date(2016, 6, 21)],
+        )
+        # Shared by clones.
+        self.assertIs(buckets, blog.get_date_buckets(qs.all(), 'date'))
+
+    def test_next_previous_indexed(self):
+        """Are neighbours found from an index, built once?"""
+
+        qs = blog.BlogPost()
+        # Scanned, so its clones share the scan, and the index on it.
+        list(iter(qs))
+        posts = list(qs.exclude_drafts())
+        with mock.patch.object(
+            blog.BlogPost,
+            '_evaluate',
+            autospec=True,
+            side_effect=blog.BlogPost._evaluate,
+        ) as evaluate:
+            for i in range(1, len(posts) - 1):
+                self.assertEqual(posts[i + 1], qs.find_next(posts[i]))
+                self.assertEqual(posts[i - 1], qs.find_previous(posts[i]))
+        self.assertEqual(1, evaluate.call_count)
+        # Drafts aren't in the sequence at all.
+        draft = qs.filter(name__startswith=blog.get_drafts_prefix())[0]
+        self.assertEqual(None, qs.find_next(draft))
+        self.assertEqual(None, qs.find_previous(draft))
+
 
 @override_settings(
     ROOT_URLCONF='tests.modules.test_blog',
@@ -45,6 +117,136 @@ class TestBlog(TestCase):
 class TestBlogView(TestCase):
     """Do the off-the-shelf blog views work?"""
 
+    def add_post(self):
+        """Add a post after the others, returning its URL path."""
+
+        directory = os.path.join(blog.BlogPost.path, '2016/07/22')
+        os.makedirs(directory)
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'new-post'), 'w') as f:
+            f.write('title: New post\n\nJust added.\n')
+        return '/blog/2016/07/22/new-post'
+
+    @override_settings(DEBUG=False)
+    def test_new_post_neighbours(self):
+        """Do posts added while running get served, with neighbours?"""
+
+        resp = self.client.get('/blog/2016/07/21/single-post')
+        self.assertEqual(200, resp.status_code)
+        path = self.add_post()
+        resp = self.client.get(path)
+        self.assertEqual(200, resp.status_code)
+        self.assertIsNone(resp.context['next_object'])
+        previous = resp.context['previous_object']
+        resp = self.client.get(previous.get_absolute_url())
+        self.assertEqual(path, resp.context['next_object'].get_absolute_url())
+
+    @override_settings(DEBUG=False)
+    def test_neighbours_shared(self):
+        """Do requests share the neighbours index until posts change?"""
+
+        indexes = []
+        _neighbours = blog.BlogPost._neighbours
+
+        def record(queryset):
+            indexes.append(_neighbours(queryset))
+            return indexes[-1]
+
+        with mock.patch.object(
+            blog.BlogPost,
+            '_neighbours',
+            autospec=True,
+            side_effect=record,
+        ):
+            for path in (
+                '/blog/2016/07/21/single-post',
+                '/blog/2016/06/21/second-post',
+            ):
+                self.assertEqual(200, self.client.get(path).status_code)
+            self.assertIs(indexes[0], indexes[-1])
+
+            self.add_post()
+            self.client.get('/blog/2016/07/21/single-post')
+            self.assertIsNot(indexes[0], indexes[-1])
+            self.assertEqual(len(indexes[0][0]) + 1, len(indexes[-1][0]))
+
+    @override_settings(DEBUG=False)
+    def test_new_post_archives(self):
+        """Do posts added while running show up in archives and feeds?"""
+
+        for path in ('/blog/', '/blog/2016/', '/blog/index.atom'):
+            self.assertEqual(200, self.client.get(path).status_code)
+        self.add_post()
+        resp = self.client.get('/blog/2016/')
+        self.assertEqual(16, resp.context['paginator'].count)
+        resp = self.client.get('/blog/')
+        self.assertEqual('New post', resp.context['object_list'][0].title)
+        resp = self.client.get('/blog/index.atom')
+        self.assertIn(b'New post', resp.content)
+
+    @override_settings(DEBUG=False)
+    def test_date_index_shared(self):
+        """Do requests share the date index until posts change?"""
+
+        def get_date_index():
+            view = blog.MonthArchiveView(
+                request=RequestFactory().get('/blog/2016/06/'),
+                kwargs={'year': '2016', 'month': '06'},
+            )
+            view.get_dated_items()
+            return blog.get_date_index(view.get_queryset(), 'date')
+
+        dates, posts = get_date_index()
+        self.assertIs(posts, get_date_index()[1])
+
+        path = self.add_post()
+        dates, new_posts = get_date_index()
+        self.assertEqual(len(posts) + 1, len(new_posts))
+        self.assertEqual(path, new_posts[-1].get_absolute_url())
+        # Posts that didn't change are the same objects.
+        self.assertIs(posts[0], new_posts[0])
+
+        # Changes in place count too.
+        stat = os.stat(new_posts[-1].path)
+        os.utime(
+            new_posts[-1].path,
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9),
+        )
+        self.assertIsNot(new_posts, get_date_index()[1])
+
+    def test_dated_queryset(self):
+        """Do archives narrow things down using the date index?"""
+
+        view = blog.MonthArchiveView(
+            request=RequestFactory().get('/blog/2016/06/'),
+            kwargs={'year': '2016', 'month': '06'},
+        )
+        date_list, qs, extra = view.get_dated_items()
+        self.assertEqual(5, len(qs._subset))
+        with mock.patch.object(
+            blog.BlogPost,
+            '_check_filters',
+            autospec=True,
+            side_effect=blog.BlogPost._check_filters,
+        ) as check_filters:
+            posts = list(iter(qs))
+        self.assertEqual(5, check_filters.call_count)
+        self.assertEqual(
+            list(
+                blog.BlogPost().exclude_drafts().filter(
+                    name__startswith='2016/06/',
+                ).order_by('-date')
+            ),
+            posts,
+        )
+
+        view = blog.MonthArchiveView(
+            request=RequestFactory().get('/blog/2016/08/'),
+            kwargs={'year': '2016', 'month': '08'},
+        )
+        with self.assertRaises(Http404):
+            view.get_dated_items()
+
     def test_simple(self):
         """Test a couple of common patterns."""
 
@@ -140,6 +342,41 @@ class TestBlogView(TestCase):
             resp.content.strip(),
         )
 
+    def test_conditional(self):
+        """Post pages support conditional GET."""
+
+        resp = self.client.get('/blog/2016/06/21/single-post')
+        self.assertEqual(200, resp.status_code)
+        resp = self.client.get(
+            '/blog/2016/06/21/single-post',
+            HTTP_IF_NONE_MATCH=resp['ETag'],
+        )
+        self.assertEqual(304, resp.status_code)
+
+    @override_settings(
+        FBO_FEED_CACHE='default',
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_blog',
+            },
+        },
+    )
+    def test_feed_cache(self):
+        """The Atom feed is cached, whatever the query string."""
+
+        resp = self.client.get('/blog/index.atom')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(10, resp.content.count(b'<entry>'))
+        with mock.patch.object(
+            blog.Feed,
+            '__call__',
+            side_effect=AssertionError('should be cached'),
+        ):
+            cached = self.client.get('/blog/index.atom?x=1')
+        self.assertEqual(resp.content, cached.content)
+        self.assertEqual(resp['Content-Type'], cached['Content-Type'])
+
     def test_baking(self):
         """Test that we can bake pages."""
 
@@ -181,3 +418,52 @@ class TestBlogView(TestCase):
                 EXPECTED_FILES,
                 set(utils.get_files(storage)),
             )
+
+    def test_bake_plan(self):
+        """Can we see what will be baked, without baking it?"""
+
+        with mock.patch(
+            'django_FBO.baking.bake_path',
+            side_effect=AssertionError('should only plan'),
+        ):
+            plan = plan_bake()
+        self.assertEqual(28, len(plan))
+        self.assertEqual('/blog/2016/', plan.entries['blog/2016/index.html'].path)
+        counts = plan.counts()
+        self.assertEqual(15, counts['django_FBO.modules.blog.DateDetailView'])
+        self.assertEqual(2, counts['django_FBO.modules.blog.DraftDetailView'])
+        # Each archive view is routed both with and without a page
+        # number, so comes up with its paths twice, and drafts come
+        # up in both DateDetailView and DraftDetailView; each is only
+        # in the plan once.
+        self.assertEqual(11, len(plan.duplicates))
+        self.assertIsInstance(
+            plan.entries['blog/drafts/draft-post.html'].view,
+            blog.DraftDetailView,
+        )
+
+    def test_baking_parallel(self):
+        """Does a parallel bake give the same output as a serial one?"""
+
+        with tempfile.TemporaryDirectory() as serial_dir, \
+                tempfile.TemporaryDirectory() as parallel_dir:
+            bake(serial_dir)
+            bake(parallel_dir, jobs=2)
+            serial = FileSystemStorage(location=serial_dir)
+            parallel = FileSystemStorage(location=parallel_dir)
+            filenames = set(utils.get_files(serial))
+            self.assertEqual(filenames, set(utils.get_files(parallel)))
+            for filename in filenames:
+                with serial.open(filename) as f1, parallel.open(filename) as f2:
+                    self.assertEqual(f1.read(), f2.read(), filename)
+
+    def test_baking_incremental(self):
+        """Does a second incremental bake leave everything alone?"""
+
+        with tempfile.TemporaryDirectory() as outdir:
+            bake(outdir, incremental=True)
+            with mock.patch(
+                'django_FBO.baking.bake_path',
+                side_effect=AssertionError('should be unchanged'),
+            ):
+                bake(outdir, incremental=True)
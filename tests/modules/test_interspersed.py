@@ -0,0 +1,262 @@
+from django.contrib.staticfiles import utils
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+import os.path
+import tempfile
+from unittest import mock
+
+from django_FBO import bake
+from django_FBO.modules import interspersed
+
+from .test_pages import Page
+
+
+TEST_BINARIES_DIR = os.path.join(
+    os.path.dirname(__file__),
+    'files/binaries',
+)
+with open(os.path.join(TEST_BINARIES_DIR, 'doc.pdf'), 'rb') as fp:
+    PDF_CONTENT = fp.read()
+
+
+class BinaryFBO(interspersed.InterspersedBinaryFBO):
+    path = TEST_BINARIES_DIR
+
+
+urlpatterns = interspersed.get_interspersed_urls(
+    ['pdf'],
+    binaryview_kwargs={'queryset': BinaryFBO()},
+    pageview_kwargs={'queryset': Page()},
+)
+
+
+@override_settings(
+    ROOT_URLCONF='tests.modules.test_interspersed',
+)
+class TestInterspersedBinaryView(TestCase):
+    """Do binary objects get served properly?"""
+
+    def test_streaming(self):
+        resp = self.client.get('/doc.pdf')
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.streaming)
+        self.assertEqual('application/pdf', resp['Content-Type'])
+        self.assertEqual(str(len(PDF_CONTENT)), resp['Content-Length'])
+        self.assertEqual(PDF_CONTENT, b''.join(resp.streaming_content))
+
+    def test_attachment(self):
+        resp = interspersed.BinaryFileResponse(
+            BinaryFBO().get(name='doc.pdf'),
+            as_attachment=True,
+            filename='report.pdf',
+        )
+        resp.close()
+        self.assertEqual(
+            'attachment; filename="report.pdf"',
+            resp['Content-Disposition'],
+        )
+        self.assertEqual('application/pdf', resp['Content-Type'])
+        self.assertEqual(str(len(PDF_CONTENT)), resp['Content-Length'])
+
+    def test_conditional(self):
+        resp = self.client.get('/doc.pdf')
+        resp.close()
+        resp = self.client.get('/doc.pdf', HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(304, resp.status_code)
+
+    @override_settings(FBO_BINARY_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        resp = self.client.get('/doc.pdf')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(
+            os.path.join(TEST_BINARIES_DIR, 'doc.pdf'),
+            resp['X-Sendfile'],
+        )
+        self.assertEqual(b'', resp.content)
+
+    @override_settings(
+        FBO_BINARY_SENDFILE='x-accel-redirect',
+        FBO_BINARY_ACCEL_REDIRECT_PREFIX='/_fbo',
+    )
+    def test_x_accel_redirect(self):
+        resp = self.client.get('/doc.pdf')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('/_fbo/doc.pdf', resp['X-Accel-Redirect'])
+        self.assertEqual(b'', resp.content)
+
+    def test_pages(self):
+        resp = self.client.get('/about')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(b'slug=about', resp.content.strip())
+
+    @override_settings(FBO_BINARY_SENDFILE='x-sendfile')
+    def test_baking(self):
+        """Binaries are baked with their content, even with sendfile."""
+
+        with tempfile.TemporaryDirectory() as outdir:
+            storage = FileSystemStorage(location=outdir)
+            bake(outdir)
+            self.assertEqual(
+                {
+                    'index.html',
+                    'about.html',
+                    'subdir/index.html',
+                    'doc.pdf',
+                },
+                set(utils.get_files(storage)),
+            )
+            with open(os.path.join(outdir, 'doc.pdf'), 'rb') as fp:
+                self.assertEqual(PDF_CONTENT, fp.read())
+
+    @mock.patch.object(
+        interspersed.InterspersedBinaryView,
+        'get_bake_source',
+        return_value=None,
+    )
+    def test_rebaking(self, get_bake_source):
+        """Is streamed output only rewritten where it has changed?"""
+
+        with tempfile.TemporaryDirectory() as outdir:
+            out_fname = os.path.join(outdir, 'doc.pdf')
+            bake(outdir)
+            os.utime(out_fname, ns=(0, 0))
+            self.assertEqual([], bake(outdir).changed)
+            self.assertEqual(0, os.stat(out_fname).st_mtime_ns)
+
+            for content in (
+                PDF_CONTENT[:-1] + b'!',
+                PDF_CONTENT[:-10],
+                PDF_CONTENT + b'more',
+            ):
+                with open(out_fname, 'wb') as fp:
+                    fp.write(content)
+                self.assertEqual(['doc.pdf'], bake(outdir).changed)
+                with open(out_fname, 'rb') as fp:
+                    self.assertEqual(PDF_CONTENT, fp.read())
+            self.assertNotIn(
+                'doc.pdf.%i.tmp' % os.getpid(),
+                os.listdir(outdir),
+            )
+
+    def test_copying(self):
+        """Are binaries copied, and only when they've changed?"""
+
+        source = os.path.join(TEST_BINARIES_DIR, 'doc.pdf')
+        with tempfile.TemporaryDirectory() as outdir:
+            out_fname = os.path.join(outdir, 'doc.pdf')
+            with mock.patch.object(
+                interspersed.InterspersedBinaryView,
+                'get',
+            ) as get:
+                self.assertIn('doc.pdf', bake(outdir).changed)
+                self.assertEqual(
+                    os.stat(source).st_mtime_ns,
+                    os.stat(out_fname).st_mtime_ns,
+                )
+                self.assertEqual([], bake(outdir).changed)
+
+                os.utime(out_fname, ns=(0, 0))
+                self.assertEqual(['doc.pdf'], bake(outdir).changed)
+                with open(out_fname, 'rb') as fp:
+                    self.assertEqual(PDF_CONTENT, fp.read())
+            # No responses were needed.
+            get.assert_not_called()
+
+    @override_settings(FBO_BAKE_HARDLINKS=True)
+    def test_hardlinks(self):
+        source = os.path.join(TEST_BINARIES_DIR, 'doc.pdf')
+        with tempfile.TemporaryDirectory() as outdir:
+            if os.stat(outdir).st_dev != os.stat(source).st_dev:
+                self.skipTest("Can't hard link across filesystems.")
+            bake(outdir)
+            self.assertTrue(
+                os.path.samefile(source, os.path.join(outdir, 'doc.pdf')),
+            )
+
+
+@override_settings(
+    ROOT_URLCONF='tests.modules.test_interspersed',
+)
+class TestRanges(TestCase):
+    """Do we support byte range requests?"""
+
+    def test_parse(self):
+        parse = interspersed.parse_range_header
+        self.assertEqual([(0, 9)], parse('bytes=0-9', 100))
+        self.assertEqual([(90, 99)], parse('bytes=-10', 100))
+        self.assertEqual([(90, 99)], parse('bytes=90-', 100))
+        self.assertEqual([(90, 99)], parse('bytes=90-200', 100))
+        self.assertEqual([(0, 0), (5, 9)], parse('bytes=0-0, 5-9', 100))
+        self.assertEqual([], parse('bytes=100-', 100))
+        # Nothing in an empty file can be satisfied.
+        self.assertEqual([], parse('bytes=-5', 0))
+        self.assertEqual([], parse('bytes=0-', 0))
+        self.assertIsNone(parse('bytes=9-0', 100))
+        self.assertIsNone(parse('lines=0-9', 100))
+        self.assertIsNone(parse('bytes=x-y', 100))
+
+    def test_single(self):
+        resp = self.client.get('/doc.pdf', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(206, resp.status_code)
+        self.assertEqual('application/pdf', resp['Content-Type'])
+        self.assertEqual(
+            'bytes 10-19/%d' % len(PDF_CONTENT),
+            resp['Content-Range'],
+        )
+        self.assertEqual('10', resp['Content-Length'])
+        self.assertEqual(PDF_CONTENT[10:20], b''.join(resp.streaming_content))
+
+    def test_suffix(self):
+        resp = self.client.get('/doc.pdf', HTTP_RANGE='bytes=-6')
+        self.assertEqual(206, resp.status_code)
+        self.assertEqual(b'%%EOF\n', b''.join(resp.streaming_content))
+
+    def test_multiple(self):
+        resp = self.client.get('/doc.pdf', HTTP_RANGE='bytes=0-3,-6')
+        self.assertEqual(206, resp.status_code)
+        content_type, boundary = resp['Content-Type'].split('; boundary=')
+        self.assertEqual('multipart/byteranges', content_type)
+        body = b''.join(resp.streaming_content)
+        self.assertEqual(str(len(body)), resp['Content-Length'])
+        parts = body.split(b'\r\n--' + boundary.encode('ascii'))
+        # Empty preamble, two parts, closing '--\r\n'.
+        self.assertEqual(4, len(parts))
+        self.assertEqual(b'--\r\n', parts[3])
+        headers, data = parts[1].split(b'\r\n\r\n', 1)
+        self.assertIn(
+            ('Content-Range: bytes 0-3/%d' % len(PDF_CONTENT)).encode('ascii'),
+            headers,
+        )
+        self.assertEqual(b'%PDF', data)
+        headers, data = parts[2].split(b'\r\n\r\n', 1)
+        self.assertEqual(b'%%EOF\n', data)
+
+    def test_unsatisfiable(self):
+        resp = self.client.get(
+            '/doc.pdf',
+            HTTP_RANGE='bytes=%d-' % len(PDF_CONTENT),
+        )
+        self.assertEqual(416, resp.status_code)
+        self.assertEqual(
+            'bytes */%d' % len(PDF_CONTENT),
+            resp['Content-Range'],
+        )
+
+    def test_if_range(self):
+        """A stale If-Range gets the whole thing."""
+
+        resp = self.client.get(
+            '/doc.pdf',
+            HTTP_RANGE='bytes=0-9',
+            HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT',
+        )
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(PDF_CONTENT, b''.join(resp.streaming_content))
+
+        resp = self.client.get(
+            '/doc.pdf',
+            HTTP_RANGE='bytes=0-9',
+            HTTP_IF_RANGE=resp['ETag'],
+        )
+        self.assertEqual(206, resp.status_code)
+        self.assertEqual(PDF_CONTENT[:10], b''.join(resp.streaming_content))
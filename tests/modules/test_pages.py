@@ -1,9 +1,11 @@
 from django.conf.urls import url
 from django.contrib.staticfiles import utils
+from django.core.cache import caches
 from django.core.files.storage import FileSystemStorage
 from django.test import TestCase, override_settings
 import os.path
 import tempfile
+from unittest import mock
 
 from django_FBO import bake
 from django_FBO.modules import pages
@@ -90,6 +92,122 @@ class TestPageView(TestCase):
             resp.content.strip(),
         )
 
+    def test_conditional(self):
+        """We get ETag and Last-Modified, and can use them."""
+
+        resp = self.client.get('/about')
+        self.assertEqual(200, resp.status_code)
+        etag = resp['ETag']
+        last_modified = resp['Last-Modified']
+
+        resp = self.client.get('/about', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b'', resp.content)
+        self.assertEqual(etag, resp['ETag'])
+        self.assertEqual(last_modified, resp['Last-Modified'])
+
+        resp = self.client.get('/about', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(etag, resp['ETag'])
+        self.assertEqual(last_modified, resp['Last-Modified'])
+
+        # Different pages, different ETags.
+        resp = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, resp.status_code)
+        self.assertNotEqual(etag, resp['ETag'])
+
+    @override_settings(
+        FBO_RENDER_CACHE='default',
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_pages',
+            },
+        },
+    )
+    def test_render_cache(self):
+        """Rendered pages can be cached."""
+
+        resp = self.client.get('/about')
+        self.assertEqual(b'slug=about', resp.content.strip())
+        with mock.patch.object(
+            PageView,
+            'get_context_data',
+            side_effect=AssertionError('should not render'),
+        ):
+            resp = self.client.get('/about')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('text/html; charset=utf-8', resp['Content-Type'])
+        self.assertEqual(b'slug=about', resp.content.strip())
+        self.assertIn('ETag', resp)
+
+        # Query strings don't make new entries.
+        with mock.patch.object(
+            PageView,
+            'get_render_cache_key',
+            side_effect=AssertionError('should not cache'),
+        ):
+            resp = self.client.get('/about?x=1')
+        self.assertEqual(b'slug=about', resp.content.strip())
+
+    @override_settings(
+        FBO_RENDER_CACHE='default',
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_pages_headers',
+            },
+        },
+    )
+    def test_render_cache_headers(self):
+        """Are headers cached, and only responses anyone can have?"""
+
+        render_to_response = PageView.render_to_response
+
+        def with_headers(headers, cookie=False):
+            def _render_to_response(view, context, **kwargs):
+                response = render_to_response(view, context, **kwargs)
+                for header, value in headers.items():
+                    response[header] = value
+                if cookie:
+                    response.set_cookie('visited', 'yes')
+                return response
+            return mock.patch.object(
+                PageView,
+                'render_to_response',
+                autospec=True,
+                side_effect=_render_to_response,
+            )
+
+        with with_headers({'Content-Language': 'en'}):
+            self.client.get('/about')
+        with mock.patch.object(
+            PageView,
+            'get_context_data',
+            side_effect=AssertionError('should not render'),
+        ):
+            resp = self.client.get('/about')
+        self.assertEqual('en', resp['Content-Language'])
+        self.assertEqual('text/html; charset=utf-8', resp['Content-Type'])
+
+        for headers, cookie in [
+            ({}, True),
+            ({'Cache-Control': 'private, max-age=60'}, False),
+            ({'Cache-Control': 'no-store'}, False),
+            ({'Vary': 'Accept-Language'}, False),
+        ]:
+            caches['default'].clear()
+            with with_headers(headers, cookie):
+                self.client.get('/')
+            with mock.patch.object(
+                PageView,
+                'get_context_data',
+                autospec=True,
+                side_effect=PageView.get_context_data,
+            ) as get_context_data:
+                self.client.get('/')
+            self.assertEqual(1, get_context_data.call_count, headers)
+
     def test_baking(self):
         """Test that we can bake pages."""
 
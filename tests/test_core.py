@@ -3,12 +3,18 @@ from django.core.exceptions import (
     ObjectDoesNotExist,
     MultipleObjectsReturned,
 )
-from django.test import SimpleTestCase as TestCase
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase as TestCase, override_settings
 from itertools import combinations
+import tempfile
+import threading
+from unittest import mock
 
 from django_FBO import FBO, FileObject
+from django_FBO import file_objects, manager, parallel
+from django_FBO.manager import bake_session
 
-from .utils import RST_FBO, TEST_FILES_ROOT
+from .utils import RST_FBO, RSTFile, TEST_FILES_ROOT
 
 
 class TestAll(TestCase):
@@ -315,6 +321,7 @@ class TestObjects(TestCase):
         obj = FBO(
             path=TEST_FILES_ROOT,
             metadata=FileObject.MetadataInFileHead,
+            model=RSTFile,
         ).all().get(
             name='test3.rst',
         )
@@ -347,6 +354,86 @@ class TestObjects(TestCase):
         )
 
 
+class TestStat(TestCase):
+    """
+    Can we get at (and query on) data from the filesystem?
+    """
+
+    def test_stat_fields(self):
+        """size, modified and created come from stat."""
+
+        obj = FBO(
+            path=TEST_FILES_ROOT,
+        ).all().get(
+            name='test1.md',
+        )
+        stat = os.stat(os.path.join(TEST_FILES_ROOT, 'test1.md'))
+
+        self.assertEqual(stat.st_size, obj.size)
+        self.assertAlmostEqual(
+            stat.st_mtime,
+            obj.modified.timestamp(),
+            delta=1e-5,
+        )
+        self.assertAlmostEqual(
+            stat.st_ctime,
+            obj.created.timestamp(),
+            delta=1e-5,
+        )
+        # Which is aware, since we have USE_TZ on.
+        self.assertIsNotNone(obj.modified.tzinfo)
+
+    def test_metadata_overrides(self):
+        """Metadata of the same name wins over stat data if asked."""
+
+        obj = RST_FBO().get(name='test3.rst')
+
+        self.assertEqual('little', obj.size)
+        self.assertEqual(
+            os.stat(os.path.join(TEST_FILES_ROOT, 'test3.rst')).st_size,
+            obj.file_size,
+        )
+
+        # But not by default.
+        obj = FBO(
+            path=TEST_FILES_ROOT,
+            metadata=FileObject.MetadataInFileHead,
+        ).get(name='test3.rst')
+        self.assertEqual(obj.file_size, obj.size)
+        self.assertEqual('little', obj.metadata['size'])
+
+    def test_stat_from_walk(self):
+        """We don't stat again after walking the tree."""
+
+        qs = FBO(
+            path=TEST_FILES_ROOT,
+            glob='*.md',
+        )
+        with mock.patch('os.stat') as _stat:
+            sizes = [o.size for o in qs.filter(size__gt=0).order_by('-size')]
+            _stat.assert_not_called()
+
+        self.assertEqual(4, len(sizes))
+        self.assertEqual(sorted(sizes, reverse=True), sizes)
+
+    def test_stat_without_reading(self):
+        """Stat fields don't need the files read for metadata."""
+
+        qs = FBO(
+            path=TEST_FILES_ROOT,
+            metadata=FileObject.MetadataInFileHead,
+        )
+        with mock.patch.object(
+            FileSystemStorage,
+            'open',
+            side_effect=AssertionError('read a file'),
+        ) as _open:
+            objs = list(qs.filter(size__gt=0).order_by('modified'))
+            _open.assert_not_called()
+
+        self.assertEqual(len(list(qs)), len(objs))
+
+
 class TestMetadataFormats(TestCase):
     """
     Can we process YAML and JSON metadata properly and automatically?
@@ -429,6 +516,64 @@ class TestMetadataFormats(TestCase):
             obj.content,
         )
 
+    def test_memoised(self):
+        """Identical front matter is only parsed once."""
+
+        content = '---\ntitle: Memo\ntags:\n - one\n---\nBody.\n'
+        first, offset = file_objects.parse_file_head(content)
+        cached = len(file_objects._parsed_heads)
+        second, _ = file_objects.parse_file_head(content)
+
+        self.assertEqual(cached, len(file_objects._parsed_heads))
+        self.assertEqual({'title': 'Memo', 'tags': ['one']}, second)
+        self.assertEqual('Body.\n', content[offset:])
+        # But callers don't share mutable metadata.
+        second['tags'].append('two')
+        self.assertEqual(['one'], first['tags'])
+
+    def test_memo_size(self):
+        """Does the memo keep a tree's worth of entries, but no more?"""
+
+        self.addCleanup(file_objects._parsed_heads.clear)
+        heads = ['title: Post %i\n\nBody.\n' % i for i in range(5000)]
+        with mock.patch.object(
+            file_objects,
+            '_yaml_loads',
+            side_effect=lambda blob: {},
+        ) as loads:
+            # Two rescans of a big tree.
+            for head in heads * 2:
+                file_objects.parse_file_head(head)
+        self.assertEqual(len(heads), loads.call_count)
+
+        with override_settings(FBO_METADATA_CACHE_SIZE=2):
+            file_objects.parse_file_head('title: Another\n\nBody.\n')
+            self.assertEqual(2, len(file_objects._parsed_heads))
+
+        # Bounded by default.
+        file_objects._parsed_heads.clear()
+        with mock.patch.object(
+            file_objects,
+            'DEFAULT_METADATA_CACHE_SIZE',
+            10,
+        ):
+            for head in heads[:20]:
+                file_objects.parse_file_head(head)
+        self.assertEqual(10, len(file_objects._parsed_heads))
+
+    def test_no_metadata_no_read(self):
+        """Without metadata, attributes don't read the file."""
+
+        qs = FBO(
+            path=TEST_FILES_ROOT,
+            glob='*.rst',
+        )
+        with mock.patch.object(FileSystemStorage, 'open') as _open:
+            obj = qs.filter(title=None).get(name='test2.rst')
+            self.assertIsNone(obj.title)
+            self.assertEqual({}, obj.metadata)
+            _open.assert_not_called()
+
 
 class TestConvenience(TestCase):
     """Test some convenience shims and wrappers."""
@@ -744,3 +889,119 @@ class TestSlugStripping(TestCase):
                 o.slug for o in qs
             },
         )
+
+
+class TestBakeSession(TestCase):
+    """Do FBOs share one snapshot of their tree while baking?"""
+
+    def test_shared(self):
+        with mock.patch.object(
+            FBO,
+            '_walk',
+            autospec=True,
+            side_effect=FBO._walk,
+        ) as walk:
+            with bake_session():
+                one = RST_FBO()
+                two = RST_FBO().filter(title__startswith='Second')
+                self.assertEqual(3, one.count())
+                self.assertEqual(['test2.rst'], [o.name for o in two])
+                self.assertIs(one._fetched, two._fetched)
+                self.assertIs(
+                    one.get(name='test2.rst'),
+                    two.get(name='test2.rst'),
+                )
+        self.assertEqual(1, walk.call_count)
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as tree:
+            with open(os.path.join(tree, 'one.md'), 'w') as f:
+                f.write('One.\n')
+            with bake_session():
+                self.assertEqual(1, FBO(path=tree).count())
+                with open(os.path.join(tree, 'two.md'), 'w') as f:
+                    f.write('Two.\n')
+                # Not until the next session.
+                self.assertEqual(1, FBO(path=tree).count())
+            self.assertEqual(2, FBO(path=tree).count())
+
+    def test_threads(self):
+        """Does a session last until every thread is done with it?"""
+
+        entered = threading.Event()
+        done = threading.Event()
+
+        def bake():
+            with bake_session():
+                entered.set()
+                done.wait()
+
+        thread = threading.Thread(target=bake)
+        thread.start()
+        entered.wait()
+        with bake_session():
+            self.assertEqual(3, RST_FBO().count())
+        self.assertIsNotNone(manager.export_session())
+        done.set()
+        thread.join()
+        self.assertIsNone(manager.export_session())
+
+    def test_worker(self):
+        """Do workers join the session without walking again?"""
+
+        with bake_session([RST_FBO()]):
+            session = manager.export_session()
+        # As if in a new worker process.
+        with mock.patch.multiple(
+            manager,
+            _snapshots=None,
+            _walks=None,
+            _session_depth=0,
+        ):
+            parallel._setup_worker(session)
+            with mock.patch.object(
+                FBO,
+                '_walk',
+                side_effect=AssertionError('walked'),
+            ):
+                for batch in range(2):
+                    with bake_session():
+                        self.assertEqual(3, RST_FBO().count())
+            self.assertIsNotNone(manager.export_session())
+
+    def test_warmed(self):
+        """Are objects already loaded reused?"""
+
+        qs = RST_FBO()
+        warmed = {o.name: o for o in qs}
+        for obj in warmed.values():
+            obj.metadata
+        with bake_session([qs]):
+            for obj in RST_FBO():
+                self.assertIs(warmed[obj.name], obj)
+
+
+class TestSharedScan(TestCase):
+    """Do FBOs share a scan of their tree until it changes?"""
+
+    @override_settings(DEBUG=True)
+    def test_shared(self):
+        with tempfile.TemporaryDirectory() as tree:
+            with open(os.path.join(tree, 'one.md'), 'w') as f:
+                f.write('One.\n')
+            one = FBO(path=tree)
+            two = FBO(path=tree, glob='*.md')
+            self.assertEqual(1, one.count())
+            self.assertEqual(1, two.count())
+            self.assertIs(one._fetched, two._fetched)
+
+            # We look again each time with DEBUG on, but only scan
+            # if something changed.
+            scan = one._fetched
+            one.count()
+            self.assertIs(scan, one._fetched)
+            with open(os.path.join(tree, 'two.md'), 'w') as f:
+                f.write('Two.\n')
+            self.assertEqual(2, one.count())
+            self.assertIsNot(scan, one._fetched)
+            self.assertIs(scan[0], one.get(name='one.md'))
@@ -0,0 +1,311 @@
+from django.conf.urls import url
+from django.test import SimpleTestCase as TestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+import datetime
+import gzip
+import os.path
+import shutil
+import tempfile
+from unittest import mock
+
+from django_FBO import FBO, Q, bake, baking, compression
+from django_FBO.dependencies import (
+    Manifest,
+    JOURNAL_NAME,
+    MANIFEST_NAME,
+    decode_query,
+    encode_query,
+    merge_manifests,
+    shard_manifest_name,
+)
+from django_FBO.modules import pages
+
+from .utils import TEST_FILES_ROOT
+
+
+PAGES_ROOT = os.path.join(
+    os.path.dirname(__file__),
+    'modules/files/pages',
+)
+
+
+class TreePage(pages.Page):
+    # Set by the tests, to a copy of PAGES_ROOT we can change.
+    path = None
+    slug_suffices = ['.md']
+
+
+class TreePageView(pages.PageView):
+
+    def get_queryset(self):
+        return TreePage()
+
+
+urlpatterns = [
+    url(r'^(?P<slug>.*)$', TreePageView.as_view(), name='page'),
+]
+
+
+class TestQuerySpec(TestCase):
+    """Can we describe an FBO and build it again later?"""
+
+    def test_round_trip(self):
+        qs = FBO(
+            path=TEST_FILES_ROOT,
+            metadata=FBO.model.MetadataInFileHead,
+        ).filter(
+            Q(name__glob='*.rst') | ~Q(title='Test'),
+            title__in=['Test', 'Another'],
+        ).exclude(
+            modified__gte=timezone.make_aware(datetime.datetime(2000, 1, 1)),
+        ).order_by('-name')[1:]
+        rebuilt = decode_query(encode_query(qs))
+        self.assertIs(FBO, type(rebuilt))
+        self.assertEqual(encode_query(qs), encode_query(rebuilt))
+        self.assertEqual([o.name for o in qs], [o.name for o in rebuilt])
+
+    def test_unencodable(self):
+        class LocalFBO(FBO):
+            pass
+
+        with self.assertRaises(TypeError):
+            encode_query(LocalFBO(path=TEST_FILES_ROOT))
+
+
+@override_settings(
+    ROOT_URLCONF='tests.test_dependencies',
+)
+class TestIncrementalBake(TestCase):
+    """Do we only rebake pages whose sources have changed?"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tree = os.path.join(tmpdir.name, 'pages')
+        shutil.copytree(PAGES_ROOT, self.tree)
+        self.outdir = os.path.join(tmpdir.name, 'out')
+        patcher = mock.patch.object(TreePage, 'path', self.tree)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bake(self):
+        """Bake incrementally, returning the paths rendered."""
+
+        with mock.patch(
+            'django_FBO.baking.bake_path',
+            wraps=baking.bake_path,
+        ) as bake_path:
+            bake(self.outdir, incremental=True)
+        return sorted(c[0][0] for c in bake_path.call_args_list)
+
+    def test_incremental(self):
+        self.assertEqual(['/', '/about', '/subdir/'], self.bake())
+        manifest = Manifest(os.path.join(self.outdir, MANIFEST_NAME))
+        self.assertEqual(
+            {'index.html', 'about.html', 'subdir/index.html'},
+            set(manifest.outputs.keys()),
+        )
+        self.assertIn(
+            os.path.join(self.tree, 'about.md'),
+            manifest.outputs['about.html']['sources'],
+        )
+
+        # Nothing has changed.
+        self.assertEqual([], self.bake())
+
+        # One page has.
+        with open(os.path.join(self.tree, 'about.md'), 'a') as f:
+            f.write('More about us.\n')
+        self.assertEqual(['/about'], self.bake())
+
+        # A new page.
+        with open(os.path.join(self.tree, 'new.md'), 'w') as f:
+            f.write('title: New\n\nA new page.\n')
+        self.assertEqual(['/new'], self.bake())
+
+        # An output that's gone missing.
+        os.unlink(os.path.join(self.outdir, 'about.html'))
+        self.assertEqual(['/about'], self.bake())
+
+        # A page that's gone away drops out of the manifest.
+        os.unlink(os.path.join(self.tree, 'new.md'))
+        self.assertEqual([], self.bake())
+        manifest = Manifest(os.path.join(self.outdir, MANIFEST_NAME))
+        self.assertNotIn('new.html', manifest.outputs)
+
+    def test_no_bake_source(self):
+        """Views without get_bake_source() aren't set up to ask."""
+
+        with mock.patch.object(
+            TreePageView,
+            '__init__',
+            side_effect=AssertionError('should not be made'),
+        ):
+            self.assertIsNone(
+                baking._get_bake_source(resolve('/about'), None),
+            )
+
+    def test_unchanged_writes(self):
+        """Do we leave identical output alone?"""
+
+        report = bake(self.outdir)
+        self.assertEqual(
+            ['about.html', 'index.html', 'subdir/index.html'],
+            report.changed,
+        )
+        about = os.path.join(self.outdir, 'about.html')
+        os.utime(about, ns=(0, 0))
+
+        report = bake(self.outdir)
+        self.assertEqual([], report.changed)
+        self.assertEqual(0, os.stat(about).st_mtime_ns)
+
+        with open(os.path.join(self.tree, 'new.md'), 'w') as f:
+            f.write('title: New\n\nA new page.\n')
+        report = bake(self.outdir)
+        self.assertEqual(['new.html'], report.changed)
+        # No temporary files left around.
+        self.assertEqual(
+            {'about.html', 'index.html', 'new.html', 'subdir'},
+            set(os.listdir(self.outdir)),
+        )
+
+    def test_removed(self):
+        """Do we remove output we no longer bake?"""
+
+        manifest = os.path.join(self.outdir, MANIFEST_NAME)
+        bake(self.outdir, manifest=manifest)
+        shutil.rmtree(os.path.join(self.tree, 'subdir'))
+        report = bake(self.outdir, manifest=manifest)
+        self.assertEqual([], report.changed)
+        self.assertEqual(['subdir/index.html'], report.removed)
+        self.assertEqual(
+            {'about.html', 'index.html', MANIFEST_NAME},
+            set(os.listdir(self.outdir)),
+        )
+
+    @mock.patch.object(compression, 'brotli', None)
+    def test_compression(self):
+        """Do we keep compressed siblings up to date?"""
+
+        compress = compression.Compression(min_size=0)
+        manifest = os.path.join(self.outdir, MANIFEST_NAME)
+        report = bake(self.outdir, manifest=manifest, compress=compress)
+        self.assertIn('about.html', report.changed)
+        self.assertIn('about.html.gz', report.changed)
+        about = os.path.join(self.outdir, 'about.html')
+        with open(about, 'rb') as f, gzip.open(about + '.gz') as gz:
+            self.assertEqual(f.read(), gz.read())
+
+        report = bake(self.outdir, manifest=manifest, compress=compress)
+        self.assertEqual([], report.changed)
+
+        # A bake that stopped after writing a page, but before
+        # compressing it, leaves a stale sibling older than its page.
+        with gzip.open(about + '.gz', 'wb') as gz:
+            gz.write(b'Stale.')
+        os.utime(about + '.gz', ns=(0, 0))
+        report = bake(self.outdir, manifest=manifest, compress=compress)
+        self.assertEqual(['about.html.gz'], report.changed)
+        with open(about, 'rb') as f, gzip.open(about + '.gz') as gz:
+            self.assertEqual(f.read(), gz.read())
+
+        # Siblings go when the page does.
+        shutil.rmtree(os.path.join(self.tree, 'subdir'))
+        report = bake(self.outdir, manifest=manifest, compress=compress)
+        self.assertEqual(
+            ['subdir/index.html', 'subdir/index.html.gz'],
+            report.removed,
+        )
+
+        # Or when it changes and is now too small.
+        with open(about, 'a') as f:
+            f.write('Changed.\n')
+        compress.min_size = os.stat(about).st_size + 100
+        report = bake(self.outdir, compress=compress)
+        self.assertEqual(['about.html'], report.changed)
+        self.assertEqual(['about.html.gz'], report.removed)
+
+    def test_shards(self):
+        """Do shards bake everything between them, just once?"""
+
+        changed = []
+        manifests = []
+        for index in (1, 2, 3):
+            report = bake(self.outdir, shard=(index, 3))
+            changed.extend(report.changed)
+            manifest = os.path.join(self.outdir, shard_manifest_name(index, 3))
+            self.assertEqual(
+                set(report.changed),
+                set(Manifest(manifest).outputs),
+            )
+            manifests.append(manifest)
+        self.assertEqual(
+            ['about.html', 'index.html', 'subdir/index.html'],
+            sorted(changed),
+        )
+
+        merged = merge_manifests(
+            os.path.join(self.outdir, MANIFEST_NAME),
+            manifests,
+        )
+        self.assertEqual(set(changed), set(merged.outputs))
+        # Which can be used for an incremental bake of everything.
+        self.assertEqual([], self.bake())
+
+        with self.assertRaises(ValueError):
+            merge_manifests(
+                os.path.join(self.outdir, MANIFEST_NAME),
+                manifests + manifests[:1],
+            )
+
+    def test_shard_of(self):
+        """Are outputs always in the same shard?"""
+
+        self.assertEqual(
+            [2, 1, 2, 1],
+            [
+                baking.shard_of(name, 3)
+                for name in ('index.html', 'about.html', 'a.html', 'b.html')
+            ],
+        )
+
+    @mock.patch.object(baking, 'CHECKPOINT_SIZE', 1)
+    def test_resume(self):
+        """Can we pick up where an unfinished bake left off?"""
+
+        original = baking.bake_path
+
+        def bake_path(path, *args, **kwargs):
+            if path == '/subdir/':
+                raise MemoryError
+            return original(path, *args, **kwargs)
+
+        with mock.patch('django_FBO.baking.bake_path', side_effect=bake_path):
+            with self.assertRaises(MemoryError):
+                bake(self.outdir)
+        journal = os.path.join(self.outdir, JOURNAL_NAME)
+        self.assertTrue(os.path.exists(journal))
+
+        # Truncated mid-write, and one page changed since.
+        with open(journal, 'a') as f:
+            f.write('["subdir/index.h')
+        with open(os.path.join(self.tree, 'about.md'), 'a') as f:
+            f.write('More about us.\n')
+
+        with mock.patch(
+            'django_FBO.baking.bake_path',
+            wraps=baking.bake_path,
+        ) as bake_path:
+            report = bake(self.outdir, resume=True)
+        self.assertEqual(
+            ['/about', '/subdir/'],
+            sorted(c[0][0] for c in bake_path.call_args_list),
+        )
+        # Including what the first bake changed.
+        self.assertEqual(
+            ['about.html', 'index.html', 'subdir/index.html'],
+            report.changed,
+        )
+        self.assertFalse(os.path.exists(journal))
@@ -0,0 +1,56 @@
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase as TestCase
+from unittest import mock
+
+from django_FBO import manager
+from django_FBO.indexing import build_index, warm
+
+from .utils import RST_FBO
+
+
+class TestIndexing(TestCase):
+    """Can we parse metadata in bulk across processes?"""
+
+    def test_build_index(self):
+        qs = RST_FBO()
+        index = build_index(qs, ['test1.rst', 'test3.rst'], jobs=2)
+        self.assertEqual(
+            {'test1.rst', 'test3.rst'},
+            set(index.keys()),
+        )
+        self.assertEqual(
+            'This one is third in the alphabet',
+            index['test3.rst']['title'],
+        )
+
+    def test_warm(self):
+        qs = RST_FBO()
+        filtered = RST_FBO().filter(title__startswith='Second')
+        with mock.patch.dict(manager._scans, clear=True):
+            warm([qs, filtered], jobs=2)
+
+            # Nothing is kept on the FBOs we warmed.
+            self.assertIsNone(qs._fetched)
+            self.assertIsNone(filtered._fetched)
+
+            # But metadata is already there for any FBO on the tree,
+            # without reading the files.
+            with mock.patch.object(
+                FileSystemStorage,
+                'open',
+                side_effect=AssertionError('read a file'),
+            ):
+                self.assertEqual(
+                    ['test2.rst'],
+                    [o.name for o in RST_FBO().filter(
+                        title__startswith='Second',
+                    )],
+                )
+            self.assertEqual(3, qs.count())
+            for obj in qs._fetched:
+                self.assertIsNone(obj._content)
+            # And we can still get at the body.
+            self.assertEqual(
+                'My little explicit YAML test.\n',
+                qs.get(name='test2.rst').content,
+            )
@@ -0,0 +1,68 @@
+from django.core.paginator import EmptyPage, InvalidPage
+from django.test import SimpleTestCase as TestCase
+from unittest import mock
+
+from django_FBO import FBO, FBOPaginator
+
+from .utils import TEST_FILES_ROOT
+
+
+class TestFBOPaginator(TestCase):
+    """Does the paginator evaluate the queryset just once?"""
+
+    def setUp(self):
+        self.qs = FBO(
+            path=TEST_FILES_ROOT,
+            glob='*.rst',
+        ).order_by('name')
+
+    def test_pages(self):
+        with mock.patch.object(
+            FBO,
+            '_evaluate',
+            autospec=True,
+            side_effect=FBO._evaluate,
+        ) as evaluate:
+            paginator = FBOPaginator(self.qs, 2)
+            self.assertEqual(3, paginator.count)
+            self.assertEqual(2, paginator.num_pages)
+            self.assertEqual(
+                ['test1.rst', 'test2.rst'],
+                [obj.name for obj in paginator.page(1)],
+            )
+            self.assertEqual(
+                ['test3.rst'],
+                [obj.name for obj in paginator.page(2)],
+            )
+        self.assertEqual(1, evaluate.call_count)
+
+    def test_page_after(self):
+        paginator = FBOPaginator(self.qs, 2)
+        page = paginator.page_after()
+        self.assertEqual(
+            ['test1.rst', 'test2.rst'],
+            [obj.name for obj in page],
+        )
+        self.assertEqual('test2.rst', page.next_cursor)
+        page = paginator.page_after(page.next_cursor)
+        self.assertEqual(['test3.rst'], [obj.name for obj in page])
+        self.assertEqual((3, 3), (page.start_index(), page.end_index()))
+        self.assertEqual(2, page.number)
+
+        # Not on a page boundary.
+        page = paginator.page_after('test1.rst')
+        self.assertEqual(
+            ['test2.rst', 'test3.rst'],
+            [obj.name for obj in page],
+        )
+        self.assertEqual(2, page.number)
+        self.assertEqual((2, 3), (page.start_index(), page.end_index()))
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+        with self.assertRaises(InvalidPage):
+            page.next_page_number()
+        with self.assertRaises(EmptyPage):
+            paginator.page_after('test3.rst')
+        with self.assertRaises(InvalidPage):
+            paginator.page_after('test1.md')
@@ -0,0 +1,47 @@
+from django.template import Context, Template
+from django.test import SimpleTestCase as TestCase, override_settings
+from unittest import mock
+
+from django_FBO.rendering import render_markdown
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test_rendering',
+        },
+    },
+)
+class TestCachedMarkdown(TestCase):
+    """Is markdown rendering cached?"""
+
+    def test_render(self):
+        self.assertEqual(
+            '<p>Some <em>text</em>.</p>\n',
+            render_markdown('Some *text*.'),
+        )
+
+    def test_cached(self):
+        first = render_markdown('Some **more** text.')
+        with mock.patch(
+            'markdown_deux.markdown',
+            side_effect=AssertionError('should be cached'),
+        ):
+            self.assertEqual(first, render_markdown('Some **more** text.'))
+
+    @override_settings(FBO_MARKDOWN_CACHE=None)
+    def test_uncached(self):
+        self.assertEqual(
+            '<p>Some <em>text</em>.</p>\n',
+            render_markdown('Some *text*.'),
+        )
+
+    def test_filter(self):
+        template = Template(
+            '{% load fbo_markdown %}{{ content|cached_markdown }}',
+        )
+        self.assertEqual(
+            '<p>A <a href="/">link</a>.</p>\n',
+            template.render(Context({'content': 'A [link](/).'})),
+        )
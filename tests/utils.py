@@ -9,7 +9,13 @@ TEST_FILES_ROOT = os.path.join(
 )
 
 
+class RSTFile(FileObject):
+    # Our reStructuredText test files have size in their front matter.
+    stat_overrides = ('size',)
+
+
 class RST_FBO(FBO):
     path = TEST_FILES_ROOT
     metadata = FileObject.MetadataInFileHead
+    model = RSTFile
     glob = '*.rst'